@@ -20,5 +20,10 @@ def classFactory(iface):  # pylint: disable=invalid-name
     :type iface: QgsInterface
     """
     #
+    import time
+    loadStartTime = time.time()
     from .hrudelin import HruDelin
-    return HruDelin(iface)
+    plugin = HruDelin(iface)
+    from qgis.core import Qgis, QgsMessageLog
+    QgsMessageLog.logMessage('plugin loaded in %.3f s' % (time.time() - loadStartTime), 'HRU delin', Qgis.Info)
+    return plugin
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare two benchmark result files written by run_benchmarks.py.
+
+Measures are matched by (suite, benchmark and raster profile, size, nbProcess) and the median
+of repeated runs is used. A throughput drop or a peak memory increase
+larger than the tolerance is reported as a regression, and the exit code
+is 1 if there is any.
+
+usage: python3 benchmarks/compare_benchmarks.py baseline.jsonl current.jsonl [--tolerance 0.1]
+"""
+
+import sys, json, argparse, statistics
+from collections import defaultdict
+
+def loadResults(path, label=None):
+    grouped = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if label is not None and record.get('label') != label:
+                continue
+            benchmark = '%s/%s' % (record['benchmark'], record.get('profile', 'default'))
+            grouped[(record['suite'], benchmark, record['size'], record['nbProcess'])].append(record)
+    return grouped
+
+def median(records, key):
+    values = [r[key] for r in records if r.get(key) is not None]
+    return statistics.median(values) if values else None
+
+def main():
+    parser = argparse.ArgumentParser(description='compare hru-delin benchmark results')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative change')
+    parser.add_argument('--baseline-label', help='only use baseline records with this label')
+    parser.add_argument('--current-label', help='only use current records with this label')
+    args = parser.parse_args()
+
+    baseline = loadResults(args.baseline, args.baseline_label)
+    current = loadResults(args.current, args.current_label)
+
+    regressions = 0
+    print('%-10s %-40s %7s %4s %14s %14s %8s %8s' % ('suite', 'benchmark', 'size', 'proc', 'base cells/s', 'cells/s', 'speed', 'memory'))
+    for key in sorted(set(baseline) & set(current)):
+        baseSpeed = median(baseline[key], 'cellsPerSecond')
+        speed = median(current[key], 'cellsPerSecond')
+        baseMemory = median(baseline[key], 'peakRss')
+        memory = median(current[key], 'peakRss')
+        if not baseSpeed or not speed:
+            continue
+        speedRatio = speed / baseSpeed
+        memoryRatio = memory / baseMemory if baseMemory and memory else None
+        flags = []
+        if speedRatio < 1 - args.tolerance:
+            flags.append('SLOWER')
+        if memoryRatio is not None and memoryRatio > 1 + args.tolerance:
+            flags.append('MORE MEMORY')
+        regressions += len(flags)
+        print('%-10s %-40s %7s %4s %14.0f %14.0f %7.2fx %7s %s' % (
+            key[0], key[1], key[2], key[3], baseSpeed, speed, speedRatio,
+            '%.2fx' % memoryRatio if memoryRatio is not None else '?', ' '.join(flags)
+        ))
+
+    if regressions:
+        print('%s regression(s)' % regressions)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
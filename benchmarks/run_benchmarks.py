@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the plugin hot paths on synthetic data.
+
+For each size (cells per side), a DEM with a known number of sub-basins,
+land use, soil and gauges are generated (see synthetic.py). Then:
+ * the layerstools converters are run on them
+ * steps 1 to 4 are run for each nbProcess value, using a project .cfg
+   template where [dir_in], [dir_out] and the dem/landuse/soil/gauges
+   entries of [files_in] are replaced by the synthetic data
+
+Each measure is repeated for each raster creation profile given with
+--profiles (see pluginUtils/rasterprofiles.py), the size of the written
+rasters is recorded with the timings.
+
+Each measure runs in its own process so peak memory is not shared between
+measures. Results are appended as JSON lines to the output file, compare
+two result files with compare_benchmarks.py.
+
+usage: python3 benchmarks/run_benchmarks.py --sizes 1000,4000 --nb-process 1,4 \
+           --template project.cfg --output results.jsonl
+"""
+
+import os, sys, time, json, argparse, subprocess, platform, configparser, resource
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+sys.path = [p for p in sys.path if os.path.abspath(p or '.') != PLUGIN_DIR]
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# converter name => (function(input path, output path), input name in the synthetic dataset, output file name)
+def converterFunctions():
+    from hrudelin.pluginUtils import layerstools
+    return {
+        'convertLddDirectionsSagaToPcRaster': (layerstools.convertLddDirectionsSagaToPcRaster, 'saga_ldd', 'ldd.tif'),
+        'translate': (lambda pathIn, pathOut: layerstools.translate(pathIn, pathOut, 'EPSG:2154'), 'dem', 'dem_copy.tif'),
+    }
+
+def directorySize(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=PLUGIN_DIR, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception as e:
+        return None
+
+def baseRecord(args):
+    from osgeo import gdal
+    return {
+        'timestamp': time.time(),
+        'commit': gitRevision(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'gdal': gdal.__version__,
+        'label': args.label,
+    }
+
+# child process for one converter measure, prints a JSON line
+def runConverterChild(name, dataDir, outDir):
+    from hrudelin.hrudelin_batch import initQgis
+    from synthetic import datasetPaths
+    app = initQgis()
+    paths = datasetPaths(dataDir)
+    os.makedirs(outDir, exist_ok=True)
+    function, inputName, outputName = converterFunctions()[name]
+    outPath = os.path.join(outDir, outputName)
+    if os.path.exists(outPath):
+        os.remove(outPath)
+    startTime = time.time()
+    startCpu = time.process_time()
+    function(paths[inputName], outPath)
+    wall = time.time() - startTime
+    cpu = time.process_time() - startCpu
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'wall': wall,
+        'cpu': cpu,
+        'peakRss': maxrss if sys.platform == 'darwin' else maxrss * 1024,
+        'outputBytes': os.path.getsize(outPath),
+    }))
+    if app is not None:
+        app.exitQgis()
+
+def writeProjectConfig(template, paths, projectDir):
+    config = configparser.ConfigParser()
+    config.read(template)
+    for section in ['dir_in', 'dir_out', 'files_in']:
+        if section not in config:
+            config[section] = {}
+    config['dir_in']['dir'] = os.path.dirname(paths['dem'])
+    config['dir_out']['files'] = os.path.join(projectDir, 'files')
+    config['dir_out']['results'] = os.path.join(projectDir, 'results')
+    for key in ['dem', 'landuse', 'soil', 'gauges']:
+        if key == 'dem' or key in config['files_in']:
+            config['files_in'][key] = os.path.basename(paths[key])
+    os.makedirs(projectDir, exist_ok=True)
+    cfgPath = os.path.join(projectDir, 'project.cfg')
+    with open(cfgPath, 'w') as f:
+        config.write(f)
+    return cfgPath
+
+# the raster profile is read from the environment by layerstools
+def profileEnvironment(profile):
+    from hrudelin.pluginUtils.rasterprofiles import PROFILE_ENV
+    environment = dict(os.environ)
+    environment[PROFILE_ENV] = profile
+    return environment
+
+def benchConverters(args, size, dataDir, output, profile):
+    for name in converterFunctions():
+        for repeat in range(args.repeat):
+            outDir = os.path.join(args.work_dir, 'out_%s_%s' % (size, profile))
+            result = subprocess.run([
+                sys.executable, os.path.abspath(__file__), '--child-converter', name, dataDir, outDir
+            ], stdout=subprocess.PIPE, check=True, env=profileEnvironment(profile))
+            measure = json.loads(result.stdout.decode('utf-8').strip().splitlines()[-1])
+            record = baseRecord(args)
+            record.update({
+                'suite': 'converters',
+                'benchmark': name,
+                'profile': profile,
+                'size': size,
+                'cells': size * size,
+                'nbProcess': 1,
+                'cellsPerSecond': size * size / measure['wall'] if measure['wall'] else None,
+            })
+            record.update(measure)
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+            print('%s %s %s: %.2f s, %.1f MB' % (name, size, profile, measure['wall'], measure['outputBytes'] / 1048576.0))
+
+def benchSteps(args, size, paths, output, profile):
+    for nbProcess in args.nb_process:
+        for repeat in range(args.repeat):
+            projectDir = os.path.join(args.work_dir, 'project_%s_%s_%s' % (size, nbProcess, profile))
+            cfgPath = writeProjectConfig(args.template, paths, projectDir)
+            timingsPath = os.path.join(projectDir, 'timings.json')
+            logPath = os.path.join(projectDir, 'run.log')
+            with open(logPath, 'w') as logFile:
+                returnCode = subprocess.call([
+                    sys.executable, os.path.join(PLUGIN_DIR, 'hrudelin_batch.py'), '--single',
+                    '-p', str(nbProcess), '--steps', args.steps, '--timings', timingsPath,
+                    '--raster-profile', profile, cfgPath
+                ], stdout=logFile, stderr=subprocess.STDOUT)
+            if returnCode != 0:
+                print('steps %s/%s FAILED, see %s' % (size, nbProcess, logPath))
+                continue
+
+            with open(timingsPath) as f:
+                timings = json.load(f)
+            stepRecords = {}
+            with open(os.path.join(projectDir, 'hrudelin_run_report.json')) as f:
+                for r in json.load(f)['records']:
+                    if r['category'] == 'step':
+                        stepRecords[r['name']] = r
+            for step, timing in sorted(timings.items()):
+                stepRecord = stepRecords.get('step %s' % step, {})
+                record = baseRecord(args)
+                record.update({
+                    'suite': 'steps',
+                    'benchmark': 'step%s' % step,
+                    'profile': profile,
+                    'size': size,
+                    'cells': size * size,
+                    'nbBasins': args.basins,
+                    'nbProcess': nbProcess,
+                    'wall': timing['wall'],
+                    'cpu': timing['cpu'],
+                    'childrenCpu': stepRecord.get('childrenCpu'),
+                    'cellsPerSecond': size * size / timing['wall'] if timing['wall'] else None,
+                    'peakRss': stepRecord.get('peakRss'),
+                    'peakChildrenRss': stepRecord.get('peakChildrenRss'),
+                    'outputBytes': directorySize(os.path.join(projectDir, 'files')),
+                })
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+                print('step %s %s/%s %s: %.2f s' % (step, size, nbProcess, profile, timing['wall']))
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child-converter':
+        runConverterChild(*sys.argv[2:5])
+        return
+
+    parser = argparse.ArgumentParser(description='hru-delin benchmarks on synthetic data')
+    parser.add_argument('--sizes', default='1000,4000,16000', help='raster sizes (cells per side)')
+    parser.add_argument('--basins', type=int, default=8, help='number of sub-basins in the synthetic DEM')
+    parser.add_argument('--nb-process', default='1,%s' % os.cpu_count(), help='nbProcess values for the steps')
+    parser.add_argument('--steps', default='1-4', help='steps to run')
+    parser.add_argument('--template', help='project .cfg template, steps are not run without it')
+    parser.add_argument('--no-converters', action='store_true', help='do not run the layerstools converters')
+    parser.add_argument('--profiles', default='default,deflate', help='raster creation profiles to compare')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of each measure')
+    parser.add_argument('--work-dir', default=os.path.join(BENCH_DIR, 'work'), help='where data and outputs are written')
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results.jsonl'), help='JSON lines result file')
+    parser.add_argument('--label', default='', help='free text stored with the results')
+    args = parser.parse_args()
+    args.nb_process = [int(n) for n in args.nb_process.split(',')]
+
+    from synthetic import generateDataset
+    with open(args.output, 'a') as output:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            dataDir = os.path.join(args.work_dir, 'data_%s_%s' % (size, args.basins))
+            print('generating %sx%s data in %s' % (size, size, dataDir))
+            paths = generateDataset(dataDir, size, args.basins)
+            for profile in args.profiles.split(','):
+                if not args.no_converters:
+                    benchConverters(args, size, dataDir, output, profile)
+                if args.template:
+                    benchSteps(args, size, paths, output, profile)
+
+if __name__ == '__main__':
+    main()
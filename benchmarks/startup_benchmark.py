@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measure QGIS launch time with the hru-delin plugin enabled and disabled.
+
+A throwaway QGIS profile is created with the plugin directory linked in
+its python/plugins directory. QGIS is launched several times with the
+plugin enabled then disabled, and the time until the startup script runs
+(after plugins are loaded) is recorded.
+
+usage: python3 benchmarks/startup_benchmark.py [--qgis qgis] [--runs 5]
+"""
+
+import os, time, json, argparse, subprocess, tempfile, statistics
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PROFILE = 'hrudelin_startup_benchmark'
+
+QUIT_SCRIPT = '''
+import time
+from qgis.PyQt.QtCore import QTimer
+from qgis.core import QgsApplication
+with open(%r, 'w') as f:
+    f.write(str(time.time()))
+QTimer.singleShot(0, QgsApplication.instance().quit)
+'''
+
+def prepareProfile(profilesPath, enabled):
+    profilePath = os.path.join(profilesPath, PROFILE)
+    pluginsPath = os.path.join(profilePath, 'python', 'plugins')
+    os.makedirs(pluginsPath, exist_ok=True)
+    pluginLink = os.path.join(pluginsPath, 'hrudelin')
+    if not os.path.exists(pluginLink):
+        os.symlink(PLUGIN_DIR, pluginLink)
+    settingsPath = os.path.join(profilePath, 'QGIS')
+    os.makedirs(settingsPath, exist_ok=True)
+    with open(os.path.join(settingsPath, 'QGIS3.ini'), 'w') as f:
+        f.write('[PythonPlugins]\nhrudelin=%s\n' % ('true' if enabled else 'false'))
+
+def launch(qgis, profilesPath, workDir):
+    stampPath = os.path.join(workDir, 'stamp')
+    scriptPath = os.path.join(workDir, 'quit.py')
+    with open(scriptPath, 'w') as f:
+        f.write(QUIT_SCRIPT % stampPath)
+    startTime = time.time()
+    subprocess.run([
+        qgis, '--profiles-path', profilesPath, '--profile', PROFILE,
+        '--nologo', '--noversioncheck', '--code', scriptPath
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    with open(stampPath) as f:
+        return float(f.read()) - startTime
+
+def main():
+    parser = argparse.ArgumentParser(description='QGIS startup time with and without hru-delin')
+    parser.add_argument('--qgis', default='qgis', help='QGIS executable')
+    parser.add_argument('--runs', type=int, default=5, help='launches per configuration')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workDir:
+        profilesPath = os.path.join(workDir, 'profiles')
+        for label, enabled in [('disabled', False), ('enabled', True)]:
+            prepareProfile(profilesPath, enabled)
+            # first launch warms the file system cache and creates the profile
+            launch(args.qgis, profilesPath, workDir)
+            times = [launch(args.qgis, profilesPath, workDir) for i in range(args.runs)]
+            results[label] = {
+                'runs': times,
+                'median': statistics.median(times),
+                'min': min(times),
+            }
+            print('plugin %s: median %.3f s, min %.3f s' % (label, results[label]['median'], results[label]['min']))
+
+    print('plugin overhead: %.3f s' % (results['enabled']['median'] - results['disabled']['median']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic inputs for the benchmarks.
+
+The DEM is made of nbBasins parallel V-shaped valleys sloping to the
+south edge, so it contains exactly nbBasins sub-basins with their outlets
+on the last row. Land use and soil are regular patterns of classes.
+Everything is written row block by row block so 16k x 16k rasters can be
+generated with bounded memory.
+"""
+
+import os
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+EPSG = 2154
+ORIGIN = (700000.0, 6600000.0)
+RESOLUTION = 25.0
+BLOCK_ROWS = 256
+
+def createRaster(path, size, dataType, nodata):
+    driver = gdal.GetDriverByName('GTiff')
+    ds = driver.Create(path, size, size, 1, dataType, ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    ds.SetGeoTransform((ORIGIN[0], RESOLUTION, 0, ORIGIN[1], 0, -RESOLUTION))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).SetNoDataValue(nodata)
+    return ds
+
+def writeByRows(path, size, dataType, nodata, blockFunction):
+    ds = createRaster(path, size, dataType, nodata)
+    band = ds.GetRasterBand(1)
+    cols = np.arange(size)
+    for row in range(0, size, BLOCK_ROWS):
+        rows = np.arange(row, min(row + BLOCK_ROWS, size))[:, None]
+        band.WriteArray(blockFunction(rows, cols[None, :]), 0, row)
+    band.FlushCache()
+    ds = None
+
+def basinWidth(size, nbBasins):
+    return size / float(nbBasins)
+
+def generateDem(path, size, nbBasins, seed=0):
+    width = basinWidth(size, nbBasins)
+    rng = np.random.RandomState(seed)
+    def block(rows, cols):
+        # distance to the valley axis, valleys are steeper across than along
+        crossDistance = np.abs((cols % width) - width / 2.0)
+        dem = 100.0 + 0.1 * (size - rows) + 0.5 * crossDistance
+        noise = rng.uniform(0, 0.01, dem.shape)
+        return (dem + noise).astype(np.float32)
+    writeByRows(path, size, gdal.GDT_Float32, -9999, block)
+
+def generateClasses(path, size, nbClasses, patchSize, shift):
+    def block(rows, cols):
+        return ((rows // patchSize) * shift + cols // patchSize) % nbClasses + 1
+    writeByRows(path, size, gdal.GDT_Int16, -9999, lambda r, c: block(r, c).astype(np.int16))
+
+# random directions in Saga encoding, used by the converter benchmarks
+def generateSagaDirections(path, size, seed=0):
+    rng = np.random.RandomState(seed)
+    writeByRows(path, size, gdal.GDT_Int16, -99,
+        lambda r, c: rng.randint(-1, 8, (r.shape[0], c.shape[1])).astype(np.int16))
+
+# one gauge per valley, just upstream of its outlet
+def generateGauges(path, size, nbBasins):
+    width = basinWidth(size, nbBasins)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    ds = driver.CreateDataSource(path)
+    layer = ds.CreateLayer('gauges', srs, ogr.wkbPoint)
+    layer.CreateField(ogr.FieldDefn('ID', ogr.OFTInteger))
+    for i in range(nbBasins):
+        col = int(i * width + width / 2.0)
+        row = size - 2
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint(ORIGIN[0] + (col + 0.5) * RESOLUTION, ORIGIN[1] - (row + 0.5) * RESOLUTION)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('ID', i + 1)
+        feature.SetGeometry(point)
+        layer.CreateFeature(feature)
+    ds = None
+
+def datasetPaths(directory):
+    return {
+        'dem': os.path.join(directory, 'dem.tif'),
+        'landuse': os.path.join(directory, 'landuse.tif'),
+        'soil': os.path.join(directory, 'soil.tif'),
+        'gauges': os.path.join(directory, 'gauges.shp'),
+        'saga_ldd': os.path.join(directory, 'saga_ldd.tif'),
+    }
+
+# generate (or reuse) the whole dataset for a size, returns the file paths
+def generateDataset(directory, size, nbBasins):
+    os.makedirs(directory, exist_ok=True)
+    paths = datasetPaths(directory)
+    if not os.path.exists(paths['dem']):
+        generateDem(paths['dem'], size, nbBasins)
+    if not os.path.exists(paths['landuse']):
+        generateClasses(paths['landuse'], size, 5, max(size // 20, 1), 3)
+    if not os.path.exists(paths['soil']):
+        generateClasses(paths['soil'], size, 4, max(size // 13, 1), 2)
+    if not os.path.exists(paths['gauges']):
+        generateGauges(paths['gauges'], size, nbBasins)
+    if not os.path.exists(paths['saga_ldd']):
+        generateSagaDirections(paths['saga_ldd'], size)
+    return paths
@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# precompile the dock widget form so it is not parsed by uic when the plugin loads
+# QGIS custom widgets are provided by qgis.gui
+pyuic5 hrudelin_dockwidget_base.ui -o hrudelin_dockwidget_base.py
+sed -i 's/^from qgs[a-z]* import \(Qgs[A-Za-z]*\)$/from qgis.gui import \1/' hrudelin_dockwidget_base.py
@@ -18,8 +18,6 @@ from .resources import *
 
 from qgis.core import QgsMapLayerProxyModel
 
-# Import the code for the DockWidget
-from .hrudelin_dockwidget import HruDelinDockWidget
 import os.path
 
 # resolve path inside plugin directory (to get included data for example)
@@ -203,6 +201,9 @@ class HruDelin:
             self.iface.removeToolBarIcon(action)
         # remove the toolbar
         del self.toolbar
+        # stop the step worker processes
+        if self.dockwidget is not None:
+            self.dockwidget.shutdownStepHost()
 
     #--------------------------------------------------------------------------
 
@@ -216,6 +217,9 @@ class HruDelin:
             #    first run of plugin
             #    removed on close (see self.onClosePlugin method)
             if self.dockwidget == None:
+                # the dock widget module (and everything it imports) is only loaded
+                # when the toolbar icon is clicked for the first time
+                from .hrudelin_dockwidget import HruDelinDockWidget
                 # Create the dockwidget (after translation) and keep reference
                 self.dockwidget = HruDelinDockWidget(None, self.iface)
 
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ Run HRU-delin projects without the QGIS GUI.
+
+ Each .cfg file is processed in its own process, with the same step
+ sequence and pre-cleaning as the dock widget. Several projects run
+ concurrently, each one writes its own log and step timings.
+
+ usage: python3 hrudelin_batch.py -j 4 -p 2 --log-dir logs a.cfg b.cfg ...
+"""
+
+import os, sys, time, json, argparse, subprocess, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# the plugin is imported as the 'hrudelin' package, its own directory must not
+# be in the path or hrudelin.py would shadow the package
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path = [p for p in sys.path if os.path.abspath(p or '.') != PLUGIN_DIR]
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+
+from hrudelin.pluginUtils.tools import prepareGrassEnv
+from hrudelin.pluginUtils.steps import importStepMain, readProjectConfig, runStep, initQgis
+from hrudelin.pluginUtils.stepcache import StepCache, StepCheckpoints
+from hrudelin.pluginUtils import instrumentation
+from hrudelin.pluginUtils.rasterprofiles import PROFILE_NAMES, currentProfileName, setProfileName
+
+GRASS_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.hrudelin_grass_cache.json')
+
+def parseSteps(text):
+    if '-' in text:
+        first, last = text.split('-')
+        return list(range(int(first), int(last) + 1))
+    return [int(s) for s in text.split(',')]
+
+# run the steps of one project in the current process
+def runProject(projectFilePath, steps, nbProcess, useCache=False):
+    prepareGrassEnv(GRASS_CACHE_PATH)
+    project = readProjectConfig(os.path.abspath(projectFilePath))
+    stepCache = StepCache(project['projectFilePath'], project['filesOutPath'], project['resultsOutPath'])
+
+    timings = {}
+    for step in steps:
+        if useCache and stepCache.isValid(step):
+            print('[STEP %s] cached' % step)
+            timings[step] = {'cached': True}
+            continue
+        stepMain = importStepMain(step)
+        stepCache.invalidate(step)
+        startTime = time.time()
+        startCpu = time.process_time()
+        with instrumentation.measure('step %s' % step, 'step', project['demPath'], nbProcess=nbProcess):
+            # with the cache, an interrupted step resumes from its finished work units
+            checkpoints = StepCheckpoints(project['filesOutPath'], step, stepCache.checkpointSignature(step) if useCache else None)
+            for event in runStep(step, project, nbProcess, stepMain, checkpoints=checkpoints):
+                print('[STEP %s] %s' % (step, ', '.join('%s %s' % item for item in sorted(event.items()))), flush=True)
+        stepCache.store(step)
+        timings[step] = {
+            'cached': False,
+            'wall': time.time() - startTime,
+            'cpu': time.process_time() - startCpu,
+        }
+        print('[STEP %s] %.2f' % (step, timings[step]['wall']), flush=True)
+        instrumentation.writeReport(
+            os.path.join(os.path.dirname(project['resultsOutPath']), 'hrudelin_run_report.json'),
+            project=project['projectFilePath'],
+            nbProcess=nbProcess
+        )
+    return timings
+
+# launch one project in a child process with its own log file
+def launchProject(index, projectFilePath, args):
+    # several projects often share the same cfg file name
+    name = '%03d_%s' % (index, os.path.splitext(os.path.basename(projectFilePath))[0])
+    logPath = os.path.join(args.log_dir, '%s.log' % name)
+    timingsPath = os.path.join(args.log_dir, '%s.json' % name)
+    command = [
+        sys.executable, os.path.abspath(__file__), '--single',
+        '-p', str(args.nb_process), '--steps', args.steps,
+        '--timings', timingsPath, projectFilePath
+    ]
+    if args.use_cache:
+        command.append('--use-cache')
+
+    startTime = time.time()
+    with open(logPath, 'w') as logFile:
+        returnCode = subprocess.call(command, stdout=logFile, stderr=subprocess.STDOUT)
+    result = {
+        'project': os.path.abspath(projectFilePath),
+        'log': logPath,
+        'success': returnCode == 0,
+        'wall': time.time() - startTime,
+        'steps': {},
+    }
+    if os.path.exists(timingsPath):
+        with open(timingsPath) as f:
+            result['steps'] = json.load(f)
+    print('%s %s in %.2f s' % (name, 'done' if result['success'] else 'FAILED', result['wall']), flush=True)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Run HRU-delin projects without QGIS GUI')
+    parser.add_argument('projects', nargs='+', help='project .cfg files')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of projects running concurrently')
+    parser.add_argument('-p', '--nb-process', type=int, default=1, help='number of processes used by each project')
+    parser.add_argument('--steps', default='1-4', help='steps to run, like 1-4 or 2,3')
+    parser.add_argument('--log-dir', default='.', help='where to write project logs and timings')
+    parser.add_argument('--report', help='write a JSON report of all projects to this file')
+    parser.add_argument('--use-cache', action='store_true', help='skip unchanged steps')
+    parser.add_argument('--raster-profile', choices=PROFILE_NAMES, default=currentProfileName(), help='creation options of the written rasters')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--timings', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # inherited by the project processes through the environment
+    setProfileName(args.raster_profile)
+
+    if args.single:
+        app = initQgis()
+        try:
+            timings = runProject(args.projects[0], parseSteps(args.steps), args.nb_process, args.use_cache)
+        except Exception as e:
+            traceback.print_exc()
+            sys.exit(1)
+        if args.timings:
+            with open(args.timings, 'w') as f:
+                json.dump(timings, f, indent=2)
+        if app is not None:
+            app.exitQgis()
+        return
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    startTime = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(lambda ip: launchProject(ip[0], ip[1], args), enumerate(args.projects)))
+    print('[FULL BATCH] %.2f' % (time.time() - startTime))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not all(r['success'] for r in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -15,15 +15,11 @@
  ***************************************************************************/
 """
 
-import os, shutil, sys, time, platform
+import os, shutil, sys, time, platform, threading
 from pathlib import Path
 import tempfile, configparser
 from zipfile import ZipFile
 from collections import defaultdict
-import numpy as np
-from osgeo import gdal, ogr, osr
-from osgeo.gdalnumeric import *
-from osgeo.gdalconst import *
 
 # resolve path inside plugin directory (to get included data like map color legends for example)
 def resolve(name, basepath=None):
@@ -38,10 +34,12 @@ from PyQt5.QtCore import pyqtSignal, QFileInfo, pyqtRemoveInputHook
 
 from qgis.core import *
 from qgis._gui import *
-import processing
 
-from hrudelin.pluginUtils import layerstools
-from hrudelin.pluginUtils.tools import isWindows, isMac, which, prepareGrassEnv
+from hrudelin.pluginUtils.tools import isWindows, isMac, which, prepareGrassEnv, autoProcessCount
+from hrudelin.pluginUtils.stepcache import StepCache, StepCheckpoints
+from hrudelin.pluginUtils.steps import readProjectConfig, cleanStep, StepHost, StepCanceled
+from hrudelin.pluginUtils import instrumentation
+from hrudelin.pluginUtils.rasterprofiles import PROFILE_ENV, PROFILE_NAMES, currentProfileName, setProfileName
 
 from multiprocessing import cpu_count
 import multiprocessing
@@ -57,24 +55,26 @@ elif isMac():
     sys.argv = [None]
     print('fix multiprocess for Mac in plugin %s'%os.path.abspath(os.path.join(sys.exec_prefix, 'bin/python3')))
 
-prepareGrassEnv()
-from hrudelin.hrudelinCore.modules.hrudelin_1_init import main as main1
-from hrudelin.hrudelinCore.modules.hrudelin_2_basins import main as main2
-from hrudelin.hrudelinCore.modules.hrudelin_3_hrugen import main as main3
-from hrudelin.hrudelinCore.modules.hrudelin_parms_J2000 import main as main4
-
-try:
-    import dbf
-    DBF=True
-except Exception as e:
-    DBF=False
+# GRASS discovery is done when a step is launched, steps run in a child process
+# which inherits the environment and gets the same arguments to prepare its own
+def prepareStepEnv():
+    grassArgs = (
+        os.path.join(QgsApplication.qgisSettingsDirPath(), 'hrudelin_grass_cache.json'),
+        Qgis.QGIS_VERSION
+    )
+    prepareGrassEnv(*grassArgs)
+    return grassArgs
 
 # this exception is used by the QgisTasks
 class CancelException(Exception):
     pass
 
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
-    os.path.dirname(__file__), 'hrudelin_dockwidget_base.ui'))
+# the form is precompiled by compile_ui.sh, parse the .ui file only if it was not
+try:
+    from hrudelin.hrudelin_dockwidget_base import Ui_IripDockWidgetBase as FORM_CLASS
+except ImportError:
+    FORM_CLASS, _ = uic.loadUiType(os.path.join(
+        os.path.dirname(__file__), 'hrudelin_dockwidget_base.ui'))
 
 class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
@@ -175,8 +175,24 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.nbProcessSpin.setValue(cpu_count())
         self.nbProcessSpin.setMinimum(1)
         self.nbProcessSpin.setMaximum(cpu_count())
+        # auto: process number chosen from DEM size and available memory, editing the spin disables it
+        self.settingAutoProcess = False
+        self.nbProcessSpin.valueChanged.connect(self.nbProcessChanged)
+        self.autoProcessCheck.stateChanged.connect(self.updateAutoProcessCount)
+        self.updateAutoProcessCount()
+        # creation options of the rasters written by the steps
+        self.rasterProfileCombo.addItems(PROFILE_NAMES)
+        self.rasterProfileCombo.setCurrentText(currentProfileName())
+        self.rasterProfileCombo.currentTextChanged.connect(setProfileName)
 
         self.layers = defaultdict(list)
+        self.stepCache = None
+        self.stepStatus = {}
+        self.stepHost = None
+        self.stepHostLock = threading.Lock()
+        self.overviewTask = None
+        self.pendingOverviews = []
+        self.overviewLock = threading.Lock()
 
         self.tempDir = tempfile.TemporaryDirectory()
         # set new default temp dir
@@ -188,6 +204,48 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.closingPlugin.emit()
         event.accept()
         self.resetProject()
+        self.shutdownStepHost()
+        if self.overviewTask is not None:
+            self.overviewTask.cancel()
+
+    # the step host process and its worker pool are kept between steps and runs, a new one
+    # is started if the number of processes or the raster profile changed or if it was killed by a cancel
+    def getStepHost(self, nbProcess, grassArgs):
+        environment = {PROFILE_ENV: currentProfileName()}
+        with self.stepHostLock:
+            if self.stepHost is not None and (
+                self.stepHost.nbProcess != nbProcess or
+                self.stepHost.environment != environment or
+                not self.stepHost.isAlive()
+            ):
+                self.stepHost.shutdown()
+                self.stepHost = None
+            if self.stepHost is None:
+                self.stepHost = StepHost(nbProcess, grassArgs, environment, QgsApplication.prefixPath())
+            return self.stepHost
+
+    def shutdownStepHost(self):
+        with self.stepHostLock:
+            if self.stepHost is not None:
+                self.stepHost.shutdown()
+                self.stepHost = None
+
+    def nbProcessChanged(self):
+        if not self.settingAutoProcess and self.autoProcessCheck.isChecked():
+            self.autoProcessCheck.setChecked(False)
+
+    def updateAutoProcessCount(self):
+        if not self.autoProcessCheck.isChecked():
+            self.processInfoLabel.setText('')
+            return
+        if getattr(self, 'demCells', None) is None:
+            self.processInfoLabel.setText(self.tr('process number will be chosen when the DEM is loaded'))
+            return
+        nbProcess, explanation = autoProcessCount(self.demCells, self.demBytesPerCell, cpu_count())
+        self.settingAutoProcess = True
+        self.nbProcessSpin.setValue(nbProcess)
+        self.settingAutoProcess = False
+        self.processInfoLabel.setText(explanation)
 
     # called when clicking on help buttons
     # just display an alert message box with help
@@ -317,20 +375,12 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.layers[tag] = []
 
     def displayLayer(self, params, targetProject=None):
-        if targetProject is None:
-            project = QgsProject.instance()
-        else:
-            project = targetProject
+        return self.displayLayers([params], targetProject)[0]
 
+    def createLayer(self, params):
         layerType = params['type']
         layerPath = params['path']
         layerName = params['name']
-        expanded = params['expanded'] if 'expanded' in params else False
-        zoom = params['zoom'] if 'zoom' in params else False
-        # default tag is 'various'
-        tag = params['tag'] if 'tag' in params else 'various'
-        # if checked not specified : True
-        layerChecked = params['checked'] if 'checked' in params else True
 
         if layerType == 'vector':
             self.iface.mainWindow().blockSignals(True)
@@ -354,30 +404,99 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                 layer.setRenderer(renderer)
 
             layer.setCrs(self.projObj)
+        return layer
 
-        # put it in the related group
-        self.addToGroup(layer, project, tag, expanded)
-
-        if not layerChecked:
-            item = project.layerTreeRoot().findLayer(layer.id())
-            if item:
-                item.setItemVisibilityChecked(False)
-            else:
-                QMessageBox.critical(
-                    self.iface.mainWindow(),
-                    self.tr('item not found'),
-                    self.tr('item %s not found'%layerName)
-                )
-
-        if zoom:
-            self.iface.setActiveLayer(layer)
+    # add several layers at once: one addMapLayers, one insertion in each group
+    # and a single canvas refresh
+    def displayLayers(self, paramsList, targetProject=None):
+        if targetProject is None:
+            project = QgsProject.instance()
+        else:
+            project = targetProject
+        if not paramsList:
+            return []
+
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            layers = [self.createLayer(params) for params in paramsList]
+            # add but not to the legend
+            project.addMapLayers(layers, False)
+
+            # put them in their related group, in the order of paramsList
+            nodesByTag = defaultdict(list)
+            for params, layer in zip(paramsList, layers):
+                tag = params['tag'] if 'tag' in params else 'various'
+                layerNode = QgsLayerTreeLayer(layer)
+                if not (params['expanded'] if 'expanded' in params else False):
+                    layerNode.setExpanded(False)
+                # if checked not specified : True
+                if not (params['checked'] if 'checked' in params else True):
+                    layerNode.setItemVisibilityChecked(False)
+                nodesByTag[tag].append(layerNode)
+            root = project.layerTreeRoot()
+            for tag, nodes in nodesByTag.items():
+                label = self.groupLabels[tag]
+                if root.findGroup(label) is None:
+                    self.createGroup(tag, project)
+                # last layer on top, as when they were inserted one by one
+                root.findGroup(label).insertChildNodes(0, nodes[::-1])
+
+            for params, layer in zip(paramsList, layers):
+                tag = params['tag'] if 'tag' in params else 'various'
+                # input files are not ours to modify
+                if params['type'] != 'vector' and tag != 'input':
+                    self.scheduleOverviews(params['path'])
+                if targetProject is not None:
+                    # we store the layers by tag to be able to remove them later
+                    self.layers[tag].append(layer)
+        finally:
+            canvas.freeze(False)
+
+        zoomLayers = [layer for params, layer in zip(paramsList, layers) if params.get('zoom', False)]
+        if zoomLayers:
+            self.iface.setActiveLayer(zoomLayers[-1])
             self.iface.zoomToActiveLayer()
+        else:
+            canvas.refresh()
+
+        return layers
+
+    # overviews of displayed rasters are built by one background task at a time
+    def scheduleOverviews(self, path):
+        with self.overviewLock:
+            if path not in self.pendingOverviews:
+                self.pendingOverviews.append(path)
+        if self.overviewTask is None:
+            self.startOverviewTask()
+
+    # rasters displayed during a step may have been rewritten since their overviews were built,
+    # buildOverviews only rebuilds the outdated ones
+    def refreshOverviews(self, paths):
+        for path in paths:
+            self.scheduleOverviews(path)
+
+    def startOverviewTask(self):
+        task = OverviewTask(self)
+        task.overviewsBuilt.connect(self.overviewsBuilt)
+        task.taskCompleted.connect(self.overviewTaskFinished)
+        task.taskTerminated.connect(self.overviewTaskFinished)
+        self.overviewTask = task
+        QgsApplication.taskManager().addTask(task)
 
-        if targetProject is not None:
-            # we store the layers by tag to be able to remove them later
-            self.layers[tag].append(layer)
+    def overviewTaskFinished(self):
+        self.overviewTask = None
+        with self.overviewLock:
+            pending = len(self.pendingOverviews) > 0
+        if pending:
+            self.startOverviewTask()
 
-        return layer
+    # layers opened before their overviews existed must reopen their file to use them
+    def overviewsBuilt(self, path):
+        for layer in QgsProject.instance().mapLayers().values():
+            if isinstance(layer, QgsRasterLayer) and os.path.normpath(layer.source()) == os.path.normpath(path):
+                layer.dataProvider().reloadData()
+                layer.triggerRepaint()
 
     # save main QGIS project or a custom one
     def saveProject(self, layerDictList, savePath):
@@ -387,8 +506,7 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         # if some layers provided, save a project displaying them
         else:
             project = QgsProject()
-            for lp in layerDictList:
-                self.displayLayer(lp, project)
+            self.displayLayers(layerDictList, project)
 
         project.write(savePath)
 
@@ -403,17 +521,10 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             return
         self.loadProjectStartTime = time.time()
 
-        projectFileDir = os.path.dirname(projectFilePath)
-        self.projectFileDir = projectFileDir
-        config = configparser.ConfigParser()
-        config.read(projectFilePath)
+        self.project = readProjectConfig(projectFilePath)
+        self.projectFileDir = self.project['projectFileDir']
         self.projectFilePath = projectFilePath
-
-        # dir_in is absolute or relative to config file parent directory
-        dir = config['dir_in']['dir']
-        if not os.path.isabs(dir):
-            dir = os.path.join(projectFileDir, dir)
-        cfgDemPath = os.path.join(dir, config['files_in']['dem'])
+        cfgDemPath = self.project['demPath']
 
         ## studyarea is absolute or relative to dir_in
         #cfgStudyareaPath = config['files_in']['studyarea'] if ('studyarea' in config['files_in']) else None
@@ -421,17 +532,18 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         #    cfgStudyareaPath = os.path.join(dir, cfgStudyareaPath)
         #cfgStudyareaField = config['studyarea_parms']['studyarea_id'] if ('studyarea_parms' in config and 'studyarea_id' in config['studyarea_parms']) else None
 
-        self.cfgFilesOutPath = config['dir_out']['files']
-        if not os.path.isabs(self.cfgFilesOutPath):
-            self.cfgFilesOutPath = os.path.join(projectFileDir, self.cfgFilesOutPath)
-
-        self.cfgResultsOutPath = config['dir_out']['results']
-        if not os.path.isabs(self.cfgResultsOutPath):
-            self.cfgResultsOutPath = os.path.join(projectFileDir, self.cfgResultsOutPath)
+        self.cfgFilesOutPath = self.project['filesOutPath']
+        self.cfgResultsOutPath = self.project['resultsOutPath']
 
         self.projectPath = os.path.dirname(self.cfgResultsOutPath)
         self.projectPathLabel.setText(self.projectPath.replace('\\', '/'))
 
+        self.stepCache = StepCache(projectFilePath, self.cfgFilesOutPath, self.cfgResultsOutPath)
+        self.stepStatus = {}
+        self.stepStatusLabel.setText('')
+        instrumentation.reset()
+        self.reportText.setPlainText('')
+
         # now get the job done
         self.mQgsFileDEM.setFilePath(cfgDemPath)
 
@@ -527,32 +639,78 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                 result_dir = self.tr('plugin_results')
                 flist = [os.path.join(outDir, f) for f in os.listdir(outDir) if os.path.isfile(os.path.join(outDir, f))]
                 for fPath in flist:
-                    zipObj.write(fPath, os.path.join(inside_dir, result_dir, os.path.basename(fPath)))
+                    self.writeToArchive(zipObj, fPath, os.path.join(inside_dir, result_dir, os.path.basename(fPath)))
                 for dirName in ['tmp', 'indicators', 'results', 'work']:
                     flist = [os.path.join(outDir, dirName, f) for f in os.listdir(os.path.join(outDir, dirName)) if os.path.isfile(os.path.join(outDir, dirName, f))]
                     for fPath in flist:
-                        zipObj.write(fPath, os.path.join(inside_dir, result_dir, dirName, os.path.basename(fPath)))
+                        self.writeToArchive(zipObj, fPath, os.path.join(inside_dir, result_dir, dirName, os.path.basename(fPath)))
+                # mosaics are built in the tmp directory of the loaded project (see stepLayerParams)
+                if getattr(self, 'project', None) is not None:
+                    for fPath in Path(self.project['tmpPath'], 'mosaics').glob('*_mosaic.vrt'):
+                        self.writeToArchive(zipObj, str(fPath), os.path.join(inside_dir, result_dir, 'mosaics', fPath.name))
         # delete temporary config file
         os.remove(tmpConfigPath)
 
         self.iface.messageBar().pushSuccess('HRU delin', self.tr('Data+config archive successfully exported to %s'%exportArchivePath))
 
+    # mosaics only reference their per-unit rasters, they are merged into a GeoTIFF when exported
+    def writeToArchive(self, zipObj, fPath, arcPath):
+        if not fPath.endswith('_mosaic.vrt'):
+            zipObj.write(fPath, arcPath)
+            return
+        from hrudelin.pluginUtils.layerstools import materializeMosaic
+        with tempfile.TemporaryDirectory() as tmpDir:
+            tifPath = os.path.join(tmpDir, os.path.basename(fPath)[:-len('.vrt')] + '.tif')
+            materializeMosaic(fPath, tifPath)
+            zipObj.write(tifPath, arcPath[:-len('.vrt')] + '.tif')
+
     def autoLaunch(self, previous=0):
 
         if previous == 0 and self.step1Check.isChecked():
-            self.doStep1(True, self.step1FinishedAuto)
+            self.launchOrSkipStep(1, self.doStep1, self.step1FinishedAuto)
         elif previous < 2 and self.step2Check.isChecked():
-            self.doStep2(True, self.step2FinishedAuto)
+            self.launchOrSkipStep(2, self.doStep2, self.step2FinishedAuto)
         elif previous < 3 and self.step3Check.isChecked():
-            self.doStep3(False, self.step3FinishedAuto)
+            self.launchOrSkipStep(3, self.doStep3, self.step3FinishedAuto)
         elif previous < 4 and self.step4Check.isChecked():
-            self.doStep4(False, self.step4FinishedAuto)
+            self.launchOrSkipStep(4, self.doStep4, self.step4FinishedAuto)
         else:
             # we must have finished now
             wholeProcessEndTime = time.time()
             print()
             print('[FULL PROCESS] %.2f'%(wholeProcessEndTime - self.loadProjectStartTime))
             print()
+            self.writeRunReport(wholeProcessEndTime - self.loadProjectStartTime)
+
+    # a step whose cfg sections, input files and outputs did not change since
+    # its last successful run is not launched again, we just display its outputs
+    def launchOrSkipStep(self, step, doStepMethod, successMethod):
+        if self.useCacheCheck.isChecked() and self.stepCache.isValid(step):
+            self.setStepStatus(step, self.tr('cached'))
+            self.removeLayersByTag('results' if step == 4 else 'step%s' % step)
+            self.displayLayers(self.stepLayerParams(step))
+            self.autoLaunch(step)
+        else:
+            self.setStepStatus(step, self.tr('running'))
+            doStepMethod(True, successMethod)
+
+    def setStepStatus(self, step, status):
+        self.stepStatus[step] = status
+        self.stepStatusLabel.setText(', '.join(
+            self.tr('step %s: %s') % (s, self.stepStatus[s]) for s in sorted(self.stepStatus)
+        ))
+        self.reportText.setPlainText(instrumentation.formatReport())
+
+    # JSON report of all measures, written next to hrudelin_final
+    def writeRunReport(self, fullProcessTime=None):
+        instrumentation.writeReport(
+            os.path.join(self.projectPath, 'hrudelin_run_report.json'),
+            project=self.projectFilePath,
+            nbProcess=self.nbProcessSpin.value(),
+            steps={str(s): status for s, status in self.stepStatus.items()},
+            fullProcess=fullProcessTime
+        )
+        self.reportText.setPlainText(instrumentation.formatReport())
 
     def step1FinishedAuto(self):
         self.step1Finished()
@@ -661,8 +819,13 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.demPath = self.mQgsFileDEM.filePath()
         self.demName = os.path.basename(self.demPath)
         if os.path.exists(self.demPath):
+            from osgeo import gdal, osr
             # we just get the projection
             fd = gdal.Open(self.demPath)
+            # used to show the throughput of running steps
+            self.demCells = fd.RasterXSize * fd.RasterYSize
+            self.demBytesPerCell = gdal.GetDataTypeSize(fd.GetRasterBand(1).DataType) // 8
+            self.updateAutoProcessCount()
             osrProj = osr.SpatialReference(wkt=fd.GetProjection())
             self.projNum = int(osrProj.GetAttrValue('AUTHORITY', 1))
             self.proj = 'EPSG:%s' % self.projNum
@@ -727,6 +890,7 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     def launchTask(self, taskName, processMethodList, successMethod=None, errorMethod=None):
         task = HruDelinTask(taskName, self, processMethodList)
         task.nbProcess = self.nbProcessSpin.value()
+        task.cells = getattr(self, 'demCells', None)
         self.task = task
 
         # configure the QgsMessageBar
@@ -747,12 +911,23 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         if errorMethod != None:
             task.taskTerminated.connect(errorMethod)
         task.progressChanged.connect(progressBar.setValue)
+        task.stageChanged.connect(self.taskStageChanged)
         task.displayLayer.connect(self.displayLayer)
+        task.displayLayers.connect(self.displayLayers)
+        task.refreshOverviews.connect(self.refreshOverviews)
 
         QgsApplication.taskManager().addTask(task)
         # WOW this "was" necessary to avoid a crash
         #print('task ADDED')
 
+    # show current stage and ETA of the running task in its message bar
+    def taskStageChanged(self, text):
+        try:
+            self.messageBar.setText(text)
+        except RuntimeError as e:
+            # message bar was already closed
+            pass
+
     # receive on click event OR is called by load process
     def doStep1(self, uselessBool, successMethod=None):
         #self.generateCatchmentBtn.setVisible(False)
@@ -771,6 +946,7 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     def step1Finished(self):
         self.iface.messageBar().popWidget(self.messageBar)
         self.iface.messageBar().pushSuccess('HRU delin', self.tr('Step 1 success'))
+        self.setStepStatus(1, self.tr('recomputed'))
 
         ## show next GUI elements
         #self.groupBoxLanduse.setVisible(True)
@@ -805,6 +981,7 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     def step2Finished(self):
         self.iface.messageBar().popWidget(self.messageBar)
         self.iface.messageBar().pushSuccess('HRU delin', self.tr('Step 2 success'))
+        self.setStepStatus(2, self.tr('recomputed'))
 
         # TODO we could add layers here...
 
@@ -845,6 +1022,7 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     def step3Finished(self):
         self.iface.messageBar().popWidget(self.messageBar)
         self.iface.messageBar().pushSuccess('HRU delin', self.tr('Step 3 success'))
+        self.setStepStatus(3, self.tr('recomputed'))
 
         # TODO we could add layers here...
 
@@ -885,6 +1063,7 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.exportDataResultsCheck.setVisible(True)
         self.iface.messageBar().popWidget(self.messageBar)
         self.iface.messageBar().pushSuccess('HRU delin', self.tr('Step 4 success'))
+        self.setStepStatus(4, self.tr('recomputed'))
 
         # add result layers here
 
@@ -932,158 +1111,206 @@ class HruDelinDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             self.iface.messageBar().pushCritical('HRU delin', self.tr('Step 4 task problem. See StackTrace for more details'))
             raise e
 
-    # here we get serious
-    def processStep1(self, task):
-        task.setProgress(0)
-
-        # do the same job as hrudelin bash script which launch python modules
-        if os.path.exists(self.cfgFilesOutPath):
-            shutil.rmtree(self.cfgFilesOutPath)
-        os.mkdir(self.cfgFilesOutPath)
-
-        if os.path.exists(self.cfgResultsOutPath):
-            shutil.rmtree(self.cfgResultsOutPath)
-        os.mkdir(self.cfgResultsOutPath)
-
-        tmpPath = os.path.join(self.projectFileDir, 'tmp')
-        if os.path.exists(tmpPath):
-            shutil.rmtree(tmpPath)
-        os.mkdir(tmpPath)
-
-        # run the mzfc
-        main1(self.projectFilePath)
-
-        # display layers
-        for fPath in Path(self.cfgFilesOutPath).rglob('*step1*.tif'):
-            strPath = str(fPath)
-            task.displayLayer.emit({
-                'type': 'raster',
-                'path': strPath,
-                'name': os.path.basename(strPath).replace('step1_', ''),
-                'tag': 'step1',
-                'zoom': (os.path.basename(strPath) == 'step1_dem_cut.tif')
+    # layer parameters of one output file of a step
+    def layerParams(self, step, path):
+        prefix = 'step%s_' % step
+        params = {
+            'type': 'vector' if path.endswith('.shp') else 'raster',
+            'path': path,
+            'name': os.path.basename(path).replace(prefix, ''),
+            'tag': 'step%s' % step
+        }
+        if os.path.basename(path) == 'step1_dem_cut.tif':
+            params['zoom'] = True
+        return params
+
+    # layers produced by a step
+    def stepLayerParams(self, step):
+        paramList = []
+        if step == 4:
+            paramList.append({
+                'type': 'vector',
+                'path': os.path.join(self.cfgResultsOutPath, 'hru.shp'),
+                'name': 'hru.shp',
+                'tag': 'results',
+                'zoom': True
             })
-        for fPath in Path(self.cfgFilesOutPath).rglob('*step1*.shp'):
-            strPath = str(fPath)
-            task.displayLayer.emit({
+            paramList.append({
                 'type': 'vector',
-                'path': strPath,
-                'name': os.path.basename(strPath).replace('step1_', ''),
-                'tag': 'step1'
+                'path': os.path.join(self.cfgResultsOutPath, 'reach.shp'),
+                'name': 'reach.shp',
+                'tag': 'results'
             })
+            return paramList
+
+        paths = []
+        for pattern in self.stepOutputPatterns(step):
+            paths += [str(fPath) for fPath in Path(self.cfgFilesOutPath).rglob(pattern)]
+
+        # per-unit rasters are displayed as one mosaic, they are not copied
+        if self.mosaicCheck.isChecked():
+            from hrudelin.pluginUtils.layerstools import groupUnitRasters, buildMosaic
+            mosaicDir = os.path.join(self.project['tmpPath'], 'mosaics')
+            os.makedirs(mosaicDir, exist_ok=True)
+            for (directory, prefix), group in groupUnitRasters(paths).items():
+                vrtPath = os.path.join(mosaicDir, '%s_mosaic.vrt' % prefix)
+                buildMosaic(group, vrtPath)
+                paramList.append({
+                    'type': 'raster',
+                    'path': vrtPath,
+                    'name': '%s (%s units)' % (prefix.replace('step%s_' % step, ''), len(group)),
+                    'tag': 'step%s' % step
+                })
+                paths = [path for path in paths if path not in group]
+
+        for path in paths:
+            paramList.append(self.layerParams(step, path))
+        return paramList
+
+    def stepOutputPatterns(self, step):
+        return ['*step%s*.tif' % step, '*step%s*.shp' % step]
 
-        return True
-
-    def processStep2(self, task):
+    # here we get serious
+    def processStep(self, task, step):
         task.setProgress(0)
-
-        for fPath in Path(self.cfgFilesOutPath).rglob('step2*.tif'):
-            os.remove(str(fPath))
-        for fPath in Path(self.cfgFilesOutPath).rglob('step3*.tif'):
-            os.remove(str(fPath))
-
-        if os.path.exists(self.cfgResultsOutPath):
-            shutil.rmtree(self.cfgResultsOutPath)
-        os.mkdir(self.cfgResultsOutPath)
+        task.startStep('step %s' % step)
+        self.stepCache.invalidate(step)
+
+        # publish intermediate outputs as soon as the step reports them finalized ({'layer': path} events),
+        # the others are published when the step is done
+        published = set()
+        publishLock = threading.Lock()
+        def publish(paths):
+            # per-unit rasters are published at the end in their mosaic
+            if self.mosaicCheck.isChecked():
+                from hrudelin.pluginUtils.layerstools import UNIT_RASTER_PATTERN
+                paths = [path for path in paths if not UNIT_RASTER_PATTERN.match(os.path.basename(path))]
+            with publishLock:
+                paths = [path for path in paths if path not in published]
+                published.update(paths)
+            if paths:
+                task.displayLayers.emit([self.layerParams(step, path) for path in paths])
+
+        # finished work units of an interrupted run are reused unless the user forces recomputation
+        checkpointSignature = None
+        if self.useCacheCheck.isChecked():
+            checkpointSignature = self.stepCache.checkpointSignature(step)
 
         # run the mzfc
-        for progress in main2(self.projectFilePath, task.nbProcess, True):
-            task.setProgress(progress)
-
-        # display layers
-        for fPath in Path(self.cfgFilesOutPath).rglob('*step2*.tif'):
-            strPath = str(fPath)
-            task.displayLayer.emit({
-                'type': 'raster',
-                'path': strPath,
-                'name': os.path.basename(strPath).replace('step2_', ''),
-                'tag': 'step2'
-            })
-        for fPath in Path(self.cfgFilesOutPath).rglob('*step2*.shp'):
-            strPath = str(fPath)
-            task.displayLayer.emit({
-                'type': 'vector',
-                'path': strPath,
-                'name': os.path.basename(strPath).replace('step2_', ''),
-                'tag': 'step2'
-            })
+        grassArgs = prepareStepEnv()
+        try:
+            # the step is measured in the host, with all its records
+            stepHost = self.getStepHost(task.nbProcess, grassArgs)
+            for event in stepHost.run(step, self.project, task.cancelEvent, checkpointSignature):
+                task.handleEvent(event)
+                if 'layer' in event and step != 4:
+                    publish([event['layer']])
+        except StepCanceled as e:
+            # remove partial outputs, previous steps and checkpointed units stay valid
+            # so the project can be resumed from this step
+            task.stageChanged.emit(self.tr('canceled, removing partial outputs'))
+            cleanStep(step, self.project, StepCheckpoints(self.cfgFilesOutPath, step, checkpointSignature).keptFiles())
+            self.stepCache.invalidate(step)
+            raise CancelException(str(e))
+        self.stepCache.store(step)
+
+        # display remaining layers
+        task.displayLayers.emit([params for params in self.stepLayerParams(step) if params['path'] not in published])
+        task.refreshOverviews.emit([path for path in published if self.layerParams(step, path)['type'] == 'raster'])
 
         return True
 
-    def processStep3(self, task):
-        task.setProgress(0)
-
-        for fPath in Path(self.cfgFilesOutPath).rglob('step3*.tif'):
-            os.remove(str(fPath))
-
-        if os.path.exists(self.cfgResultsOutPath):
-            shutil.rmtree(self.cfgResultsOutPath)
-        os.mkdir(self.cfgResultsOutPath)
-
-        # run the mzfc
-        for progress in main3(self.projectFilePath, task.nbProcess, True):
-            task.setProgress(progress)
+    def processStep1(self, task):
+        return self.processStep(task, 1)
 
-        # display layers
-        for fPath in Path(self.cfgFilesOutPath).rglob('*step3*.tif'):
-            strPath = str(fPath)
-            task.displayLayer.emit({
-                'type': 'raster',
-                'path': strPath,
-                'name': os.path.basename(strPath).replace('step3_', ''),
-                'tag': 'step3'
-            })
-        for fPath in Path(self.cfgFilesOutPath).rglob('*step3*.shp'):
-            strPath = str(fPath)
-            task.displayLayer.emit({
-                'type': 'vector',
-                'path': strPath,
-                'name': os.path.basename(strPath).replace('step3_', ''),
-                'tag': 'step3'
-            })
+    def processStep2(self, task):
+        return self.processStep(task, 2)
 
-        return True
+    def processStep3(self, task):
+        return self.processStep(task, 3)
 
     def processStep4(self, task):
-        task.setProgress(0)
+        return self.processStep(task, 4)
 
-        if os.path.exists(self.cfgResultsOutPath):
-            shutil.rmtree(self.cfgResultsOutPath)
-        os.mkdir(self.cfgResultsOutPath)
 
-        for fPath in Path(os.path.join(self.projectFileDir, 'tmp')).rglob('topolog*'):
-            os.remove(str(fPath))
+class OverviewTask(QgsTask):
+    overviewsBuilt = QtCore.pyqtSignal(str)
+    def __init__(self, dockwidget):
+        QgsTask.__init__(self, 'HRU delin overviews', QgsTask.CanCancel)
+        self.dockwidget = dockwidget
 
-        # run the mzfc
-        for progress in main4(self.projectFilePath, task.nbProcess, True):
-            task.setProgress(progress)
-
-        # display layers
-        task.displayLayer.emit({
-            'type': 'vector',
-            'path': os.path.join(self.cfgResultsOutPath, 'hru.shp'),
-            'name': 'hru.shp',
-            'tag': 'results',
-            'zoom': True
-        })
-        task.displayLayer.emit({
-            'type': 'vector',
-            'path': os.path.join(self.cfgResultsOutPath, 'reach.shp'),
-            'name': 'reach.shp',
-            'tag': 'results'
-        })
+    def nextPath(self):
+        with self.dockwidget.overviewLock:
+            if self.dockwidget.pendingOverviews:
+                return self.dockwidget.pendingOverviews.pop(0)
+        return None
 
-        return True
+    def run(self):
+        from hrudelin.pluginUtils.layerstools import buildOverviews
+        path = self.nextPath()
+        while path is not None and not self.isCanceled():
+            # the file might have been removed by a step launched since
+            if os.path.exists(path):
+                try:
+                    if buildOverviews(path, callback=lambda complete, message, data: 0 if self.isCanceled() else 1):
+                        self.overviewsBuilt.emit(path)
+                except Exception as e:
+                    print('overviews of %s failed: %s' % (path, e))
+            path = self.nextPath()
+        return not self.isCanceled()
+
+
+def formatDuration(seconds):
+    if seconds >= 3600:
+        return '%dh %02dmin' % (seconds // 3600, (seconds % 3600) // 60)
+    if seconds >= 60:
+        return '%dmin %02ds' % (seconds // 60, seconds % 60)
+    return '%ds' % seconds
 
 
 class HruDelinTask(QgsTask):
     displayLayer = QtCore.pyqtSignal(object)
+    displayLayers = QtCore.pyqtSignal(object)
+    refreshOverviews = QtCore.pyqtSignal(object)
+    stageChanged = QtCore.pyqtSignal(str)
     def __init__(self, desc, dockwidget, methodsToCall):
         QgsTask.__init__(self, desc, QgsTask.CanCancel)
         self.dockwidget = dockwidget
         self.methodsToCall = methodsToCall
         self.exception = None
         self.desc = desc
+        self.cells = None
+        self.stage = desc
+        self.stepName = desc
+        self.stepStartTime = time.time()
+        # forwarded to the step host process and its workers
+        self.cancelEvent = threading.Event()
+
+    def startStep(self, name):
+        self.stepName = name
+        self.stage = name
+        self.stepStartTime = time.time()
+
+    # handle an event yielded by runStep: stage name, progress percentage, finalized layer
+    def handleEvent(self, event):
+        if 'stage' in event:
+            self.stage = event['stage']
+        if 'progress' in event:
+            self.setProgress(event['progress'])
+        self.stageChanged.emit(self.statusText())
+
+    # "stage - 42% - ETA 3min 10s (1.2 Mcells/s)"
+    def statusText(self):
+        text = '%s: %s' % (self.stepName, self.stage) if self.stage != self.stepName else self.stage
+        progress = self.progress()
+        elapsed = time.time() - self.stepStartTime
+        if 0 < progress < 100:
+            text += ' - %d%%' % progress
+            remaining = elapsed * (100 - progress) / progress
+            text += ' - ETA %s' % formatDuration(remaining)
+            if self.cells:
+                text += ' (%.1f Mcells/s)' % (self.cells * progress / 100.0 / elapsed / 1e6)
+        return text
 
     def run(self):
         #print('task starting')
@@ -1091,6 +1318,8 @@ class HruDelinTask(QgsTask):
         try:
             self.setProgress(2)
             for method in self.methodsToCall:
+                if self.isCanceled():
+                    raise CancelException('%s canceled' % self.desc)
                 ret = method(self)
         except Exception as e:
             self.exception = e
@@ -1105,6 +1334,7 @@ class HruDelinTask(QgsTask):
 
     def cancel(self):
         self.dockwidget.iface.messageBar().pushMessage(
-            self.desc + ': ' + self.dockwidget.tr('Task canceled, killing it might take some time. Close QGIS to kill it.')
+            self.desc + ': ' + self.dockwidget.tr('Task canceled, stopping worker processes...')
         )
+        self.cancelEvent.set()
         super().cancel()
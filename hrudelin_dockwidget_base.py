@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+# Form implementation generated from reading ui file 'hrudelin_dockwidget_base.ui'
+#
+# Created by: PyQt5 UI code generator 5.15.11
+#
+# WARNING: Any manual changes made to this file will be lost when pyuic5 is
+# run again.  Do not edit this file unless you know what you are doing.
+
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class Ui_IripDockWidgetBase(object):
+    def setupUi(self, IripDockWidgetBase):
+        IripDockWidgetBase.setObjectName("IripDockWidgetBase")
+        IripDockWidgetBase.resize(447, 740)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Preferred)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(IripDockWidgetBase.sizePolicy().hasHeightForWidth())
+        IripDockWidgetBase.setSizePolicy(sizePolicy)
+        IripDockWidgetBase.setMinimumSize(QtCore.QSize(340, 272))
+        self.dockWidgetContents = QtWidgets.QWidget()
+        self.dockWidgetContents.setObjectName("dockWidgetContents")
+        self.verticalLayout_2 = QtWidgets.QVBoxLayout(self.dockWidgetContents)
+        self.verticalLayout_2.setObjectName("verticalLayout_2")
+        self.tabWidget = QtWidgets.QTabWidget(self.dockWidgetContents)
+        self.tabWidget.setObjectName("tabWidget")
+        self.tabInputFiles = QtWidgets.QWidget()
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Maximum, QtWidgets.QSizePolicy.Maximum)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.tabInputFiles.sizePolicy().hasHeightForWidth())
+        self.tabInputFiles.setSizePolicy(sizePolicy)
+        self.tabInputFiles.setObjectName("tabInputFiles")
+        self.verticalLayout = QtWidgets.QVBoxLayout(self.tabInputFiles)
+        self.verticalLayout.setObjectName("verticalLayout")
+        self.inputScrollArea = QtWidgets.QScrollArea(self.tabInputFiles)
+        self.inputScrollArea.setStyleSheet("")
+        self.inputScrollArea.setFrameShape(QtWidgets.QFrame.NoFrame)
+        self.inputScrollArea.setFrameShadow(QtWidgets.QFrame.Plain)
+        self.inputScrollArea.setLineWidth(0)
+        self.inputScrollArea.setWidgetResizable(True)
+        self.inputScrollArea.setObjectName("inputScrollArea")
+        self.scrollAreaWidgetContents = QtWidgets.QWidget()
+        self.scrollAreaWidgetContents.setGeometry(QtCore.QRect(0, 0, 407, 654))
+        self.scrollAreaWidgetContents.setObjectName("scrollAreaWidgetContents")
+        self.verticalLayout_3 = QtWidgets.QVBoxLayout(self.scrollAreaWidgetContents)
+        self.verticalLayout_3.setObjectName("verticalLayout_3")
+        self.resetButton = QtWidgets.QPushButton(self.scrollAreaWidgetContents)
+        self.resetButton.setObjectName("resetButton")
+        self.verticalLayout_3.addWidget(self.resetButton)
+        self.loadButton = QtWidgets.QPushButton(self.scrollAreaWidgetContents)
+        self.loadButton.setObjectName("loadButton")
+        self.verticalLayout_3.addWidget(self.loadButton)
+        self.horizontalLayout_5 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_5.setObjectName("horizontalLayout_5")
+        self.debugCheck = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.debugCheck.setObjectName("debugCheck")
+        self.horizontalLayout_5.addWidget(self.debugCheck)
+        spacerItem = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_5.addItem(spacerItem)
+        self.nbProcessLabel = QtWidgets.QLabel(self.scrollAreaWidgetContents)
+        self.nbProcessLabel.setObjectName("nbProcessLabel")
+        self.horizontalLayout_5.addWidget(self.nbProcessLabel)
+        self.nbProcessSpin = QtWidgets.QSpinBox(self.scrollAreaWidgetContents)
+        self.nbProcessSpin.setMinimumSize(QtCore.QSize(50, 0))
+        self.nbProcessSpin.setObjectName("nbProcessSpin")
+        self.horizontalLayout_5.addWidget(self.nbProcessSpin)
+        self.autoProcessCheck = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.autoProcessCheck.setChecked(True)
+        self.autoProcessCheck.setObjectName("autoProcessCheck")
+        self.horizontalLayout_5.addWidget(self.autoProcessCheck)
+        spacerItem1 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_5.addItem(spacerItem1)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_5)
+        self.processInfoLabel = QtWidgets.QLabel(self.scrollAreaWidgetContents)
+        self.processInfoLabel.setText("")
+        self.processInfoLabel.setWordWrap(True)
+        self.processInfoLabel.setObjectName("processInfoLabel")
+        self.verticalLayout_3.addWidget(self.processInfoLabel)
+        self.horizontalLayout_9 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_9.setObjectName("horizontalLayout_9")
+        self.rasterProfileLabel = QtWidgets.QLabel(self.scrollAreaWidgetContents)
+        self.rasterProfileLabel.setObjectName("rasterProfileLabel")
+        self.horizontalLayout_9.addWidget(self.rasterProfileLabel)
+        self.rasterProfileCombo = QtWidgets.QComboBox(self.scrollAreaWidgetContents)
+        self.rasterProfileCombo.setObjectName("rasterProfileCombo")
+        self.horizontalLayout_9.addWidget(self.rasterProfileCombo)
+        self.mosaicCheck = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.mosaicCheck.setChecked(False)
+        self.mosaicCheck.setObjectName("mosaicCheck")
+        self.horizontalLayout_9.addWidget(self.mosaicCheck)
+        spacerItem2 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_9.addItem(spacerItem2)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_9)
+        self.horizontalLayout_3 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_3.setObjectName("horizontalLayout_3")
+        self.step1Check = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.step1Check.setChecked(True)
+        self.step1Check.setObjectName("step1Check")
+        self.horizontalLayout_3.addWidget(self.step1Check)
+        self.step2Check = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.step2Check.setChecked(True)
+        self.step2Check.setObjectName("step2Check")
+        self.horizontalLayout_3.addWidget(self.step2Check)
+        self.step3Check = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.step3Check.setChecked(True)
+        self.step3Check.setObjectName("step3Check")
+        self.horizontalLayout_3.addWidget(self.step3Check)
+        self.step4Check = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.step4Check.setChecked(True)
+        self.step4Check.setObjectName("step4Check")
+        self.horizontalLayout_3.addWidget(self.step4Check)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_3)
+        self.horizontalLayout_8 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_8.setObjectName("horizontalLayout_8")
+        self.useCacheCheck = QtWidgets.QCheckBox(self.scrollAreaWidgetContents)
+        self.useCacheCheck.setChecked(True)
+        self.useCacheCheck.setObjectName("useCacheCheck")
+        self.horizontalLayout_8.addWidget(self.useCacheCheck)
+        self.stepStatusLabel = QtWidgets.QLabel(self.scrollAreaWidgetContents)
+        self.stepStatusLabel.setText("")
+        self.stepStatusLabel.setWordWrap(True)
+        self.stepStatusLabel.setObjectName("stepStatusLabel")
+        self.horizontalLayout_8.addWidget(self.stepStatusLabel)
+        self.verticalLayout_3.addLayout(self.horizontalLayout_8)
+        self.reportGroupBox = QgsCollapsibleGroupBox(self.scrollAreaWidgetContents)
+        self.reportGroupBox.setCollapsed(True)
+        self.reportGroupBox.setObjectName("reportGroupBox")
+        self.verticalLayout_9 = QtWidgets.QVBoxLayout(self.reportGroupBox)
+        self.verticalLayout_9.setObjectName("verticalLayout_9")
+        self.reportText = QtWidgets.QPlainTextEdit(self.reportGroupBox)
+        self.reportText.setReadOnly(True)
+        self.reportText.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.reportText.setObjectName("reportText")
+        self.verticalLayout_9.addWidget(self.reportText)
+        self.verticalLayout_3.addWidget(self.reportGroupBox)
+        self.projectBox = QtWidgets.QGroupBox(self.scrollAreaWidgetContents)
+        self.projectBox.setObjectName("projectBox")
+        self.gridLayout_4 = QtWidgets.QGridLayout(self.projectBox)
+        self.gridLayout_4.setObjectName("gridLayout_4")
+        self.horizontalLayout = QtWidgets.QHBoxLayout()
+        self.horizontalLayout.setObjectName("horizontalLayout")
+        self.gridLayout_4.addLayout(self.horizontalLayout, 0, 2, 1, 1)
+        self.changeProjectPathButton = QtWidgets.QPushButton(self.projectBox)
+        self.changeProjectPathButton.setObjectName("changeProjectPathButton")
+        self.gridLayout_4.addWidget(self.changeProjectPathButton, 2, 2, 1, 1)
+        self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_2.setObjectName("horizontalLayout_2")
+        self.projectPathLabel = QtWidgets.QLabel(self.projectBox)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Preferred)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.projectPathLabel.sizePolicy().hasHeightForWidth())
+        self.projectPathLabel.setSizePolicy(sizePolicy)
+        self.projectPathLabel.setText("")
+        self.projectPathLabel.setWordWrap(True)
+        self.projectPathLabel.setTextInteractionFlags(QtCore.Qt.LinksAccessibleByMouse|QtCore.Qt.TextSelectableByKeyboard|QtCore.Qt.TextSelectableByMouse)
+        self.projectPathLabel.setObjectName("projectPathLabel")
+        self.horizontalLayout_2.addWidget(self.projectPathLabel)
+        self.gridLayout_4.addLayout(self.horizontalLayout_2, 1, 2, 1, 1)
+        self.frame_3 = QtWidgets.QFrame(self.projectBox)
+        self.frame_3.setFrameShape(QtWidgets.QFrame.NoFrame)
+        self.frame_3.setFrameShadow(QtWidgets.QFrame.Raised)
+        self.frame_3.setObjectName("frame_3")
+        self.horizontalLayout_4 = QtWidgets.QHBoxLayout(self.frame_3)
+        self.horizontalLayout_4.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_4.setObjectName("horizontalLayout_4")
+        self.projectPathTitleLabel = QtWidgets.QLabel(self.frame_3)
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Preferred)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.projectPathTitleLabel.sizePolicy().hasHeightForWidth())
+        self.projectPathTitleLabel.setSizePolicy(sizePolicy)
+        self.projectPathTitleLabel.setMinimumSize(QtCore.QSize(150, 0))
+        self.projectPathTitleLabel.setMaximumSize(QtCore.QSize(250, 16777215))
+        self.projectPathTitleLabel.setWordWrap(True)
+        self.projectPathTitleLabel.setObjectName("projectPathTitleLabel")
+        self.horizontalLayout_4.addWidget(self.projectPathTitleLabel)
+        self.projectPathHelpButton = QtWidgets.QPushButton(self.frame_3)
+        self.projectPathHelpButton.setMaximumSize(QtCore.QSize(25, 16777215))
+        self.projectPathHelpButton.setText("")
+        self.projectPathHelpButton.setObjectName("projectPathHelpButton")
+        self.horizontalLayout_4.addWidget(self.projectPathHelpButton)
+        self.gridLayout_4.addWidget(self.frame_3, 1, 1, 1, 1)
+        self.verticalLayout_3.addWidget(self.projectBox)
+        self.groupBoxMnt = QtWidgets.QGroupBox(self.scrollAreaWidgetContents)
+        self.groupBoxMnt.setObjectName("groupBoxMnt")
+        self.verticalLayout_7 = QtWidgets.QVBoxLayout(self.groupBoxMnt)
+        self.verticalLayout_7.setObjectName("verticalLayout_7")
+        self.gridLayout = QtWidgets.QGridLayout()
+        self.gridLayout.setObjectName("gridLayout")
+        self.mQgsFileDEM = QgsFileWidget(self.groupBoxMnt)
+        self.mQgsFileDEM.setObjectName("mQgsFileDEM")
+        self.gridLayout.addWidget(self.mQgsFileDEM, 0, 1, 1, 1)
+        self.demFileLabel = QtWidgets.QLabel(self.groupBoxMnt)
+        self.demFileLabel.setEnabled(True)
+        self.demFileLabel.setMinimumSize(QtCore.QSize(0, 0))
+        self.demFileLabel.setMaximumSize(QtCore.QSize(250, 16777215))
+        self.demFileLabel.setWordWrap(True)
+        self.demFileLabel.setObjectName("demFileLabel")
+        self.gridLayout.addWidget(self.demFileLabel, 0, 0, 1, 1)
+        self.verticalLayout_7.addLayout(self.gridLayout)
+        self.verticalLayout_3.addWidget(self.groupBoxMnt)
+        spacerItem3 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.verticalLayout_3.addItem(spacerItem3)
+        self.inputScrollArea.setWidget(self.scrollAreaWidgetContents)
+        self.verticalLayout.addWidget(self.inputScrollArea)
+        self.tabWidget.addTab(self.tabInputFiles, "")
+        self.tabExport = QtWidgets.QWidget()
+        self.tabExport.setObjectName("tabExport")
+        self.verticalLayout_6 = QtWidgets.QVBoxLayout(self.tabExport)
+        self.verticalLayout_6.setObjectName("verticalLayout_6")
+        self.exportFrame = QtWidgets.QFrame(self.tabExport)
+        self.exportFrame.setFrameShape(QtWidgets.QFrame.NoFrame)
+        self.exportFrame.setFrameShadow(QtWidgets.QFrame.Raised)
+        self.exportFrame.setObjectName("exportFrame")
+        self.horizontalLayout_6 = QtWidgets.QHBoxLayout(self.exportFrame)
+        self.horizontalLayout_6.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_6.setObjectName("horizontalLayout_6")
+        self.exportButton = QtWidgets.QPushButton(self.exportFrame)
+        self.exportButton.setObjectName("exportButton")
+        self.horizontalLayout_6.addWidget(self.exportButton)
+        self.exportHelpButton = QtWidgets.QPushButton(self.exportFrame)
+        self.exportHelpButton.setMaximumSize(QtCore.QSize(25, 16777215))
+        self.exportHelpButton.setText("")
+        self.exportHelpButton.setObjectName("exportHelpButton")
+        self.horizontalLayout_6.addWidget(self.exportHelpButton)
+        self.verticalLayout_6.addWidget(self.exportFrame)
+        self.exportDataFrame = QtWidgets.QFrame(self.tabExport)
+        self.exportDataFrame.setFrameShape(QtWidgets.QFrame.NoFrame)
+        self.exportDataFrame.setFrameShadow(QtWidgets.QFrame.Raised)
+        self.exportDataFrame.setObjectName("exportDataFrame")
+        self.horizontalLayout_7 = QtWidgets.QHBoxLayout(self.exportDataFrame)
+        self.horizontalLayout_7.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_7.setObjectName("horizontalLayout_7")
+        self.exportDataButton = QtWidgets.QPushButton(self.exportDataFrame)
+        self.exportDataButton.setObjectName("exportDataButton")
+        self.horizontalLayout_7.addWidget(self.exportDataButton)
+        self.exportDataHelpButton = QtWidgets.QPushButton(self.exportDataFrame)
+        self.exportDataHelpButton.setMaximumSize(QtCore.QSize(25, 16777215))
+        self.exportDataHelpButton.setText("")
+        self.exportDataHelpButton.setObjectName("exportDataHelpButton")
+        self.horizontalLayout_7.addWidget(self.exportDataHelpButton)
+        self.verticalLayout_6.addWidget(self.exportDataFrame)
+        self.exportDataResultsCheck = QtWidgets.QCheckBox(self.tabExport)
+        self.exportDataResultsCheck.setObjectName("exportDataResultsCheck")
+        self.verticalLayout_6.addWidget(self.exportDataResultsCheck)
+        spacerItem4 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.verticalLayout_6.addItem(spacerItem4)
+        self.tabWidget.addTab(self.tabExport, "")
+        self.verticalLayout_2.addWidget(self.tabWidget)
+        IripDockWidgetBase.setWidget(self.dockWidgetContents)
+
+        self.retranslateUi(IripDockWidgetBase)
+        self.tabWidget.setCurrentIndex(0)
+        QtCore.QMetaObject.connectSlotsByName(IripDockWidgetBase)
+
+    def retranslateUi(self, IripDockWidgetBase):
+        _translate = QtCore.QCoreApplication.translate
+        IripDockWidgetBase.setWindowTitle(_translate("IripDockWidgetBase", "IRIP"))
+        self.resetButton.setText(_translate("IripDockWidgetBase", "Reset project"))
+        self.loadButton.setText(_translate("IripDockWidgetBase", "Load project file"))
+        self.debugCheck.setText(_translate("IripDockWidgetBase", "debug"))
+        self.nbProcessLabel.setText(_translate("IripDockWidgetBase", "process number"))
+        self.autoProcessCheck.setText(_translate("IripDockWidgetBase", "auto"))
+        self.rasterProfileLabel.setText(_translate("IripDockWidgetBase", "raster outputs"))
+        self.mosaicCheck.setText(_translate("IripDockWidgetBase", "mosaic per-unit rasters"))
+        self.step1Check.setText(_translate("IripDockWidgetBase", "step 1"))
+        self.step2Check.setText(_translate("IripDockWidgetBase", "step2"))
+        self.step3Check.setText(_translate("IripDockWidgetBase", "step3"))
+        self.step4Check.setText(_translate("IripDockWidgetBase", "step4"))
+        self.useCacheCheck.setText(_translate("IripDockWidgetBase", "skip unchanged steps"))
+        self.reportGroupBox.setTitle(_translate("IripDockWidgetBase", "run report"))
+        self.projectBox.setTitle(_translate("IripDockWidgetBase", "Project"))
+        self.changeProjectPathButton.setText(_translate("IripDockWidgetBase", "Change"))
+        self.projectPathTitleLabel.setText(_translate("IripDockWidgetBase", "Project path"))
+        self.groupBoxMnt.setTitle(_translate("IripDockWidgetBase", "Digital elevation model"))
+        self.mQgsFileDEM.setFilter(_translate("IripDockWidgetBase", "*.tif ;; All files (*)"))
+        self.demFileLabel.setText(_translate("IripDockWidgetBase", "DEM"))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.tabInputFiles), _translate("IripDockWidgetBase", "Input files"))
+        self.exportButton.setText(_translate("IripDockWidgetBase", "export cfg file"))
+        self.exportDataButton.setText(_translate("IripDockWidgetBase", "export portable config with input data"))
+        self.exportDataResultsCheck.setText(_translate("IripDockWidgetBase", "include results in exported archive"))
+        self.tabWidget.setTabText(self.tabWidget.indexOf(self.tabExport), _translate("IripDockWidgetBase", "Export"))
+from qgis.gui import QgsCollapsibleGroupBox
+from qgis.gui import QgsFileWidget
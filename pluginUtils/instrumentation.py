@@ -0,0 +1,185 @@
+import os, sys, time, json, threading, functools
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RASTER_EXTENSIONS = ('.tif', '.tiff', '.map', '.vrt', '.sdat')
+
+records = []
+recordsLock = threading.Lock()
+localState = threading.local()
+
+# high-water mark of the resident memory of this process, in bytes
+def peakRss():
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on Mac
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+# largest resident memory among finished child processes, in bytes
+def peakChildrenRss():
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+# cpu time of finished child processes (multiprocessing workers)
+def childrenCpuTime():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+# bytes read/written by this process on storage
+def ioCounters():
+    if os.path.exists('/proc/self/io'):
+        counters = {}
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+        return counters['read_bytes'], counters['write_bytes']
+    if psutil is not None:
+        try:
+            io = psutil.Process().io_counters()
+            return io.read_bytes, io.write_bytes
+        except Exception as e:
+            pass
+    return None, None
+
+def rasterDimensions(path):
+    try:
+        from osgeo import gdal
+        ds = gdal.Open(path)
+        if ds is None:
+            return None
+        return {'path': path, 'width': ds.RasterXSize, 'height': ds.RasterYSize, 'cells': ds.RasterXSize * ds.RasterYSize}
+    except Exception as e:
+        return None
+
+def difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+# record wall time, cpu time, peak memory and I/O of a block of code
+class measure:
+    def __init__(self, name, category='', rasterPath=None, **info):
+        self.name = name
+        self.category = category
+        self.rasterPath = rasterPath
+        self.info = info
+
+    def __enter__(self):
+        stack = getattr(localState, 'stack', None)
+        if stack is None:
+            stack = localState.stack = []
+        self.depth = len(stack)
+        stack.append(self.name)
+        self.startTime = time.time()
+        self.startCpu = time.process_time()
+        self.startChildrenCpu = childrenCpuTime()
+        self.startRead, self.startWritten = ioCounters()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        endRead, endWritten = ioCounters()
+        record = {
+            'name': self.name,
+            'category': self.category,
+            'depth': self.depth,
+            'thread': threading.current_thread().name,
+            'start': self.startTime,
+            'wall': time.time() - self.startTime,
+            'cpu': time.process_time() - self.startCpu,
+            'childrenCpu': difference(childrenCpuTime(), self.startChildrenCpu),
+            'peakRss': peakRss(),
+            'peakChildrenRss': peakChildrenRss(),
+            'bytesRead': difference(endRead, self.startRead),
+            'bytesWritten': difference(endWritten, self.startWritten),
+            'raster': rasterDimensions(self.rasterPath) if self.rasterPath else None,
+            'error': None if excType is None else repr(excValue),
+        }
+        record.update(self.info)
+        localState.stack.pop()
+        with recordsLock:
+            records.append(record)
+        return False
+
+def firstRasterPath(args):
+    for arg in args:
+        if isinstance(arg, str) and arg.lower().endswith(RASTER_EXTENSIONS) and os.path.exists(arg):
+            return arg
+    return None
+
+# decorator measuring each call, raster dimensions are taken from the first raster path argument
+def instrumented(category):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(func.__name__, category, firstRasterPath(args)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def reset():
+    with recordsLock:
+        del records[:]
+
+def getRecords():
+    with recordsLock:
+        return list(records)
+
+# records of another process (step host) are taken there and merged here
+def takeRecords():
+    with recordsLock:
+        taken = list(records)
+        del records[:]
+    return taken
+
+def mergeRecords(otherRecords):
+    with recordsLock:
+        records.extend(otherRecords)
+
+def writeReport(path, **info):
+    report = dict(info)
+    report['records'] = getRecords()
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+def formatBytes(value):
+    if value is None:
+        return '?'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(value) < 1024:
+            return '%.1f %s' % (value, unit)
+        value /= 1024.0
+    return '%.1f TB' % value
+
+def formatRecord(record):
+    text = '%s%s: wall %.2fs, cpu %.2fs' % ('  ' * record['depth'], record['name'], record['wall'], record['cpu'])
+    if record['childrenCpu']:
+        text += ' (+%.2fs workers)' % record['childrenCpu']
+    text += ', peak %s, read %s, written %s' % (
+        formatBytes(record['peakRss']), formatBytes(record['bytesRead']), formatBytes(record['bytesWritten'])
+    )
+    if record['raster']:
+        text += ', %sx%s' % (record['raster']['width'], record['raster']['height'])
+    if record.get('workerUtilization'):
+        text += ', workers busy %s' % ' '.join('%d%%' % (u * 100) for u in sorted(record['workerUtilization'].values(), reverse=True))
+    if record['error']:
+        text += ' FAILED'
+    return text
+
+# records are appended when they end, show them in start order so nested ones follow their parent
+def formatReport():
+    return '\n'.join(formatRecord(r) for r in sorted(getRecords(), key=lambda r: (r['start'], r['depth'])))
@@ -1,12 +1,90 @@
-import sys, os
+import sys, os, re
 import processing
 from osgeo import ogr, osr, gdal, gdalconst
 from osgeo.gdalnumeric import *
 from osgeo.gdalconst import *
 import numpy as np
+import multiprocessing
 #import gdal
+from hrudelin.pluginUtils.instrumentation import instrumented, measure, firstRasterPath
+from hrudelin.pluginUtils.rasterprofiles import profileCreationOptions
+from hrudelin.pluginUtils.scheduler import scheduleUnits
 
-def rasterize(model, vector, field, rasterOut, proj, dataTypeNumber=3, burnValue=None):
+# 'processing' runs the QGIS processing algorithms (one GDAL command line per call)
+# 'gdal' does the same job in-process and accepts /vsimem/ and .vrt intermediates
+DEFAULT_BACKEND = 'processing'
+
+# DATA_TYPE enums of the processing algorithms
+RASTERIZE_TYPES = ['Byte', 'Int16', 'UInt16', 'UInt32', 'Int32', 'Float32', 'Float64']
+TRANSLATE_TYPES = [None, 'Byte', 'Int16', 'UInt16', 'UInt32', 'Int32', 'Float32', 'Float64']
+
+GDAL_FORMATS = {
+    '.tif': 'GTiff',
+    '.tiff': 'GTiff',
+    '.map': 'PCRaster',
+    '.vrt': 'VRT',
+    '.sdat': 'SAGA',
+}
+
+def gdalFormatFromPath(path):
+    return GDAL_FORMATS.get(os.path.splitext(path)[1].lower(), 'GTiff')
+
+# processing algorithms take creation options as 'KEY=VALUE|KEY2=VALUE2'
+def parseCreationOptions(options):
+    return [o for o in (options or '').split('|') if o]
+
+FLOAT_TYPES = [gdal.GDT_Float32, gdal.GDT_Float64, gdal.GDT_CFloat32, gdal.GDT_CFloat64]
+
+def rasterDataType(path):
+    gd = gdal.Open(path) if isinstance(path, str) else None
+    if gd is None:
+        return None
+    return gd.GetRasterBand(1).DataType
+
+# creation options of the current raster profile (see rasterprofiles) merged with explicit options,
+# which win. Only GeoTIFF files on disk are concerned, the data type (or the one of source) sets the predictor
+def creationOptions(path, dataType=None, options=(), source=None):
+    options = list(options)
+    if gdalFormatFromPath(path) != 'GTiff' or path.startswith('/vsimem/'):
+        return options
+    if dataType is None and source is not None:
+        dataType = rasterDataType(source)
+    keys = set(o.split('=')[0].upper() for o in options)
+    profile = profileCreationOptions(dataType in FLOAT_TYPES)
+    return [o for o in profile if o.split('=')[0].upper() not in keys] + options
+
+# same thing for the OPTIONS parameter of processing algorithms
+def processingOptions(path, dataType=None, options='', source=None):
+    return '|'.join(creationOptions(path, dataType, parseCreationOptions(options), source))
+
+def dataTypeByName(name):
+    return gdal.GetDataTypeByName(name) if name else None
+
+def inMemoryPath(name):
+    return '/vsimem/hrudelin/%s' % name
+
+def deleteRaster(path):
+    if path.startswith('/vsimem/'):
+        gdal.Unlink(path)
+    elif os.path.exists(path):
+        gdal.GetDriverByName(gdalFormatFromPath(path)).Delete(path)
+
+def getBackend(backend, *paths):
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    # processing runs in another process which can't see our memory
+    if backend == 'processing' and any(isinstance(p, str) and p.startswith('/vsimem/') for p in paths):
+        raise Exception('In-memory rasters can only be used with the gdal backend')
+    return backend
+
+# every processing call is measured (see instrumentation)
+def runProcessing(algorithm, params):
+    rasterPath = firstRasterPath([params.get('INPUT'), params.get('INPUT_A'), params.get('map')])
+    with measure(algorithm, 'processing', rasterPath):
+        return processing.run(algorithm, params)
+
+@instrumented('layerstools')
+def rasterize(model, vector, field, rasterOut, proj, dataTypeNumber=3, burnValue=None, backend=None):
     extent = model.extent()
     xmin = extent.xMinimum()
     xmax = extent.xMaximum()
@@ -16,6 +94,10 @@ def rasterize(model, vector, field, rasterOut, proj, dataTypeNumber=3, burnValue
     pixelXsize = model.rasterUnitsPerPixelX()
     pixelYsize = model.rasterUnitsPerPixelY()
 
+    if getBackend(backend, vector, rasterOut) == 'gdal':
+        rasterizeMany(model, [(vector, field, dataTypeNumber, burnValue)], proj, [rasterOut])
+        return
+
     params = {
         'INPUT': vector,
         'FIELD': field,
@@ -29,13 +111,187 @@ def rasterize(model, vector, field, rasterOut, proj, dataTypeNumber=3, burnValue
         'BURN': burnValue,
         'INVERT': False,
         'INIT': None,
-        'OPTIONS': '',
+        'OPTIONS': processingOptions(rasterOut, dataTypeByName(RASTERIZE_TYPES[dataTypeNumber])),
         'OUTPUT': rasterOut
     }
-    processing.run('gdal:rasterize', params)
+    runProcessing('gdal:rasterize', params)
     #print(rasterOut, params)
 
-def clipRasterWithRaster(inModelLayer, inRasterPath, outRasterPath):
+# same nodata as gdal:rasterize whatever the data type (GDAL clamps it for unsigned types)
+RASTERIZE_NODATA = -9999
+
+# (width, height, geoTransform) of the grid of a model layer (or raster path)
+def modelGrid(model):
+    if isinstance(model, str):
+        gd = gdal.Open(model)
+        return gd.RasterXSize, gd.RasterYSize, gd.GetGeoTransform()
+    extent = model.extent()
+    pixelXsize = model.rasterUnitsPerPixelX()
+    pixelYsize = model.rasterUnitsPerPixelY()
+    width = int(round(extent.width() / pixelXsize))
+    height = int(round(extent.height() / pixelYsize))
+    return width, height, (extent.xMinimum(), pixelXsize, 0, extent.yMaximum(), 0, -pixelYsize)
+
+# first layer of a vector, its geometries are reprojected to srs once (in memory) if needed,
+# so the layer can be burnt several times without reprojecting it each time
+def preparedVectorLayer(vector, srs):
+    ds = ogr.Open(vector)
+    if ds is None:
+        raise Exception('Could not open %s' % vector)
+    layer = ds.GetLayer(0)
+    layerSrs = layer.GetSpatialRef()
+    if layerSrs is None or layerSrs.IsSame(srs):
+        return ds, layer
+    layerSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(layerSrs, srs)
+    memDs = ogr.GetDriverByName('Memory').CreateDataSource('')
+    memLayer = memDs.CreateLayer(layer.GetName(), srs, layer.GetGeomType())
+    layerDefn = layer.GetLayerDefn()
+    for i in range(layerDefn.GetFieldCount()):
+        memLayer.CreateField(layerDefn.GetFieldDefn(i))
+    for feature in layer:
+        memFeature = ogr.Feature(memLayer.GetLayerDefn())
+        memFeature.SetFrom(feature)
+        geometry = memFeature.GetGeometryRef()
+        if geometry is not None:
+            geometry.Transform(transform)
+        memLayer.CreateFeature(memFeature)
+    return memDs, memLayer
+
+# rasterize several vectors on the grid of model in one pass:
+# the grid is computed once, each vector is opened (and reprojected) once whatever
+# the number of its fields to burn, all rasters are written in-process.
+# specs: list of (vector, field), (vector, field, dataTypeNumber) or (vector, field, dataTypeNumber, burnValue),
+# dataTypeNumber as in rasterize (RASTERIZE_TYPES, 3 by default)
+# rasterOut: list of GeoTIFF paths (one raster per spec) or one GeoTIFF path (one band per spec,
+# the data type of the bands is large enough for every spec)
+@instrumented('layerstools')
+def rasterizeMany(model, specs, proj, rasterOut):
+    width, height, geoTransform = modelGrid(model)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(proj)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    for spec in specs:
+        if len(spec) < 2 or len(spec) > 4:
+            raise Exception('Rasterize spec %s should be (vector, field[, dataTypeNumber[, burnValue]])' % (spec,))
+    specs = [tuple(spec) + (3, None)[len(spec) - 2:] for spec in specs]
+    dataTypes = [gdal.GetDataTypeByName(RASTERIZE_TYPES[spec[2]]) for spec in specs]
+
+    def createRaster(path, bandCount, dataType):
+        if gdalFormatFromPath(path) != 'GTiff':
+            raise Exception('rasterizeMany writes GeoTIFF files only, not %s' % path)
+        deleteRaster(path)
+        driver = gdal.GetDriverByName('GTiff')
+        gd = driver.Create(path, width, height, bandCount, dataType, creationOptions(path, dataType))
+        if gd is None:
+            raise Exception('Could not create %s' % path)
+        gd.SetGeoTransform(geoTransform)
+        gd.SetProjection(srs.ExportToWkt())
+        for i in range(bandCount):
+            band = gd.GetRasterBand(i + 1)
+            band.SetNoDataValue(RASTERIZE_NODATA)
+            band.Fill(RASTERIZE_NODATA)
+        return gd
+
+    if isinstance(rasterOut, str):
+        dataType = dataTypes[0]
+        for otherType in dataTypes[1:]:
+            dataType = gdal.DataTypeUnion(dataType, otherType)
+        outGd = createRaster(rasterOut, len(specs), dataType)
+        targets = [(outGd, i + 1) for i in range(len(specs))]
+    else:
+        if len(rasterOut) != len(specs):
+            raise Exception('rasterizeMany needs one output per spec')
+        targets = [(createRaster(path, 1, dataType), 1) for path, dataType in zip(rasterOut, dataTypes)]
+
+    vectors = {}
+    for (vector, field, dataTypeNumber, burnValue), (gd, bandNumber) in zip(specs, targets):
+        if vector not in vectors:
+            vectors[vector] = preparedVectorLayer(vector, srs)
+        layer = vectors[vector][1]
+        layer.ResetReading()
+        if field:
+            result = gdal.RasterizeLayer(gd, [bandNumber], layer, options=['ATTRIBUTE=%s' % field])
+        else:
+            result = gdal.RasterizeLayer(gd, [bandNumber], layer, burn_values=[burnValue])
+        if result != 0:
+            raise Exception('Could not rasterize %s' % vector)
+
+    for gd, bandNumber in targets:
+        gd.FlushCache()
+    vectors = None
+    targets = None
+    outGd = None
+
+# grids are compared up to this fraction of a pixel
+GRID_TOLERANCE = 1e-3
+
+def modelCrs(model):
+    if isinstance(model, str):
+        return gdal.Open(model).GetProjection()
+    return model.crs().toWkt()
+
+def sameCrs(crs, otherCrs):
+    if not crs or not otherCrs:
+        return not crs and not otherCrs
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    otherSrs = osr.SpatialReference()
+    otherSrs.SetFromUserInput(otherCrs)
+    return bool(srs.IsSame(otherSrs))
+
+# True if the raster has the crs and the pixel size of geoTransform (north-up grids).
+# pixel sizes may only differ by what shifts the last pixel of the raster by GRID_TOLERANCE
+def samePixelSize(gd, geoTransform, crs):
+    gt = gd.GetGeoTransform()
+    if gt[2] != 0 or gt[4] != 0 or geoTransform[2] != 0 or geoTransform[4] != 0:
+        return False
+    if abs(gt[1] - geoTransform[1]) * gd.RasterXSize > abs(geoTransform[1]) * GRID_TOLERANCE \
+            or abs(gt[5] - geoTransform[5]) * gd.RasterYSize > abs(geoTransform[5]) * GRID_TOLERANCE:
+        return False
+    return sameCrs(gd.GetProjection(), crs)
+
+# pixel window (xoff, yoff, xsize, ysize) of the model grid in the raster when they share
+# crs, pixel size and pixel alignment and the raster covers the whole model extent, None otherwise.
+# such a raster is read as is, without resampling
+def gridWindow(model, rasterPath):
+    width, height, geoTransform = modelGrid(model)
+    gd = gdal.Open(rasterPath)
+    if gd is None or not samePixelSize(gd, geoTransform, modelCrs(model)):
+        return None
+    gt = gd.GetGeoTransform()
+    xoff = (geoTransform[0] - gt[0]) / gt[1]
+    yoff = (geoTransform[3] - gt[3]) / gt[5]
+    if abs(xoff - round(xoff)) > GRID_TOLERANCE or abs(yoff - round(yoff)) > GRID_TOLERANCE:
+        return None
+    xoff = int(round(xoff))
+    yoff = int(round(yoff))
+    if xoff < 0 or yoff < 0 or xoff + width > gd.RasterXSize or yoff + height > gd.RasterYSize:
+        return None
+    return xoff, yoff, width, height
+
+# True if the raster is exactly on the model grid (crs, pixel size, origin and extent)
+def gridMatches(model, rasterPath):
+    window = gridWindow(model, rasterPath)
+    if window is None:
+        return False
+    gd = gdal.Open(rasterPath)
+    return window == (0, 0, gd.RasterXSize, gd.RasterYSize)
+
+# window of a raster written without resampling: a .vrt pathOut only references
+# the source pixels, other formats get a plain copy
+@instrumented('layerstools')
+def copyRasterWindow(pathIn, pathOut, srcWin=None):
+    deleteRaster(pathOut)
+    gdal.Translate(pathOut, pathIn,
+        format=gdalFormatFromPath(pathOut),
+        creationOptions=creationOptions(pathOut, source=pathIn),
+        srcWin=srcWin
+    )
+
+# a raster already aligned on the model grid is cut by pixel window, whatever the backend
+@instrumented('layerstools')
+def clipRasterWithRaster(inModelLayer, inRasterPath, outRasterPath, backend=None):
     projId = inModelLayer.crs().authid()
     extent = inModelLayer.extent()
     xmin = extent.xMinimum()
@@ -43,22 +299,162 @@ def clipRasterWithRaster(inModelLayer, inRasterPath, outRasterPath):
     ymin = extent.yMinimum()
     ymax = extent.yMaximum()
 
-    processing.run('gdal:cliprasterbyextent', {
+    window = gridWindow(inModelLayer, inRasterPath)
+    if window is not None:
+        copyRasterWindow(inRasterPath, outRasterPath, list(window))
+        return
+
+    if getBackend(backend, inRasterPath, outRasterPath) == 'gdal':
+        gdal.Translate(outRasterPath, inRasterPath,
+            format=gdalFormatFromPath(outRasterPath),
+            creationOptions=creationOptions(outRasterPath, source=inRasterPath),
+            projWin=[xmin, ymax, xmax, ymin],
+            projWinSRS=projId
+        )
+        return
+
+    runProcessing('gdal:cliprasterbyextent', {
         'DATA_TYPE': 0,
         'EXTRA': '',
         'INPUT': inRasterPath,
         'NODATA': None,
-        'OPTIONS': '',
+        'OPTIONS': processingOptions(outRasterPath, source=inRasterPath),
         'OUTPUT': outRasterPath,
         'PROJWIN': '%f,%f,%f,%f [%s]'% (xmin, xmax, ymin, ymax, projId)
         # supposed to look like '816737.5,818087.5,6385482.5,6386632.5 [EPSG:2154]'
     })
 
-def convertToPCRasterFormat(pathIn, pathOut, dataType, proj, dataTypeNumber=None):
-    if dataTypeNumber == None:
-        processing.run('gdal:translate', {
+# in-process equivalent of gdal:translate
+@instrumented('layerstools')
+def translate(pathIn, pathOut, proj, options='', dataTypeNumber=None, metadata=None):
+    outputType = TRANSLATE_TYPES[dataTypeNumber] if dataTypeNumber else None
+    gdal.Translate(pathOut, pathIn,
+        format=gdalFormatFromPath(pathOut),
+        creationOptions=creationOptions(pathOut, dataTypeByName(outputType), parseCreationOptions(options), pathIn),
+        outputType=gdal.GetDataTypeByName(outputType) if outputType else gdal.GDT_Unknown,
+        outputSRS=proj,
+        metadataOptions=metadata
+    )
+
+# PCRaster value scales and the cell type written for each of them (CSF UINT1, INT4, REAL4)
+PCRASTER_CELL_TYPES = {
+    'VS_BOOLEAN': gdal.GDT_Byte,
+    'VS_LDD': gdal.GDT_Byte,
+    'VS_NOMINAL': gdal.GDT_Int32,
+    'VS_ORDINAL': gdal.GDT_Int32,
+    'VS_SCALAR': gdal.GDT_Float32,
+    'VS_DIRECTION': gdal.GDT_Float32,
+}
+
+# value scale found in creation options ('PCRASTER_VALUESCALE=VS_NOMINAL|...' or a list)
+def pcrasterValueScale(options):
+    if isinstance(options, str):
+        options = parseCreationOptions(options)
+    for o in options or []:
+        key, _, value = o.partition('=')
+        if key.strip().upper() == 'PCRASTER_VALUESCALE':
+            return value.strip().upper()
+    return None
+
+# write a PCRaster map with one pixel pass: the source is read through an in-memory VRT
+# (or a MEM dataset for an array) already converted to the cell type of the value scale and
+# carrying the projection, the PCRaster driver then writes the map and its nodata once.
+# source: raster path or 2D array (geoTransform needed), valueScale None lets GDAL choose
+# from the data type. dataType forces the cell type
+@instrumented('layerstools')
+def writePCRasterMap(source, pathOut, valueScale=None, proj=None, geoTransform=None, nodata=None, dataType=None):
+    if valueScale is not None and valueScale not in PCRASTER_CELL_TYPES:
+        raise Exception('Unknown PCRaster value scale %s' % valueScale)
+    if dataType is None and valueScale is not None:
+        dataType = PCRASTER_CELL_TYPES[valueScale]
+    wkt = None
+    if proj:
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(proj)
+        wkt = srs.ExportToWkt()
+
+    if isinstance(source, np.ndarray):
+        if geoTransform is None:
+            raise Exception('A geoTransform is needed to write an array to %s' % pathOut)
+        if dataType is None:
+            dataType = NumericTypeCodeToGDALTypeCode(source.dtype)
+        height, width = source.shape
+        srcGd = gdal.GetDriverByName('MEM').Create('', width, height, 1, dataType)
+        srcGd.SetGeoTransform(geoTransform)
+        if wkt:
+            srcGd.SetProjection(wkt)
+        band = srcGd.GetRasterBand(1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(source)
+    else:
+        srcGd = gdal.Translate('', source,
+            format='VRT',
+            outputType=dataType if dataType is not None else gdal.GDT_Unknown,
+            outputSRS=wkt,
+            noData=nodata
+        )
+        if srcGd is None:
+            raise Exception('Could not read %s' % source)
+
+    deleteRaster(pathOut)
+    options = ['PCRASTER_VALUESCALE=%s' % valueScale] if valueScale else []
+    outGd = gdal.GetDriverByName('PCRaster').CreateCopy(pathOut, srcGd, options=options)
+    if outGd is None:
+        raise Exception('Could not write PCRaster map %s' % pathOut)
+    # .map files have no projection, GDAL keeps it aside (.aux.xml) if the copy did not
+    if wkt and not outGd.GetProjection():
+        outGd.SetProjection(wkt)
+    outGd = None
+    srcGd = None
+
+# number of cells of a raster path or array, cost of the work units working on it
+def rasterCells(source):
+    if isinstance(source, np.ndarray):
+        return source.size
+    gd = gdal.Open(source)
+    if gd is None:
+        return 0
+    return gd.RasterXSize * gd.RasterYSize
+
+# pool work unit of writePCRasterMaps: (source, pathOut, valueScale, proj)
+def writePCRasterMapUnit(unit):
+    writePCRasterMap(*unit)
+    return unit[1]
+
+# write several PCRaster maps in parallel. The PCRaster library is not thread-safe,
+# each map is written by a worker process which opens its own datasets.
+# exports: list of (source, pathOut, valueScale), sources are raster paths
+# (arrays need a geoTransform, give them to writePCRasterMap instead).
+# maps are dispatched largest first (see scheduler) to pool, or to nbProcess new workers
+@instrumented('layerstools')
+def writePCRasterMaps(exports, proj=None, pool=None, nbProcess=None):
+    units = [(source, pathOut, valueScale, proj) for source, pathOut, valueScale in exports]
+    if pool is None:
+        if nbProcess is None:
+            nbProcess = os.cpu_count() or 1
+        nbProcess = min(nbProcess, len(units))
+        if nbProcess > 1:
+            with multiprocessing.Pool(nbProcess) as ownPool:
+                writePCRasterMaps(exports, proj, ownPool)
+            return
+    costs = {unit: rasterCells(unit[0]) for unit in units}
+    for unit, pathOut in scheduleUnits(writePCRasterMapUnit, units, costs, pool, 'writePCRasterMaps'):
+        pass
+
+# .map outputs are written by writePCRasterMap whatever the backend,
+# dataType holds creation options like 'PCRASTER_VALUESCALE=VS_SCALAR'
+@instrumented('layerstools')
+def convertToPCRasterFormat(pathIn, pathOut, dataType, proj, dataTypeNumber=None, backend=None):
+    if gdalFormatFromPath(pathOut) == 'PCRaster':
+        writePCRasterMap(pathIn, pathOut, pcrasterValueScale(dataType), proj,
+            dataType=dataTypeByName(TRANSLATE_TYPES[dataTypeNumber]) if dataTypeNumber else None)
+    elif getBackend(backend, pathIn, pathOut) == 'gdal':
+        translate(pathIn, pathOut, proj, dataType, dataTypeNumber)
+    elif dataTypeNumber == None:
+        runProcessing('gdal:translate', {
             'INPUT': pathIn,
-            'OPTIONS': dataType,
+            'OPTIONS': processingOptions(pathOut, None, dataType, pathIn),
             #'DATA_TYPE': 6,
             'TARGET_CRS': proj,
             'NODATA': None,
@@ -66,9 +462,9 @@ def convertToPCRasterFormat(pathIn, pathOut, dataType, proj, dataTypeNumber=None
             'OUTPUT': pathOut
         })
     else:
-        processing.run('gdal:translate', {
+        runProcessing('gdal:translate', {
             'INPUT': pathIn,
-            'OPTIONS': dataType,
+            'OPTIONS': processingOptions(pathOut, dataTypeByName(TRANSLATE_TYPES[dataTypeNumber]), dataType),
             'DATA_TYPE': dataTypeNumber,
             'TARGET_CRS': proj,
             'NODATA': None,
@@ -76,10 +472,18 @@ def convertToPCRasterFormat(pathIn, pathOut, dataType, proj, dataTypeNumber=None
             'OUTPUT': pathOut
         })
 
-def convertToPCRasterLDDFormat(pathIn, pathOut, dataType, proj):
-    processing.run('gdal:translate', {
+@instrumented('layerstools')
+def convertToPCRasterLDDFormat(pathIn, pathOut, dataType, proj, backend=None):
+    if gdalFormatFromPath(pathOut) == 'PCRaster':
+        writePCRasterMap(pathIn, pathOut, 'VS_LDD', proj)
+        return
+    if getBackend(backend, pathIn, pathOut) == 'gdal':
+        translate(pathIn, pathOut, proj, dataType, 1, ['PCRASTER_VALUESCALE=VS_LDD'])
+        return
+
+    runProcessing('gdal:translate', {
         'INPUT': pathIn,
-        'OPTIONS': dataType,
+        'OPTIONS': processingOptions(pathOut, gdal.GDT_Byte, dataType),
         'EXTRA' : '-mo PCRASTER_VALUESCALE=VS_LDD',
         'DATA_TYPE': 1,
         'TARGET_CRS': proj,
@@ -88,11 +492,14 @@ def convertToPCRasterLDDFormat(pathIn, pathOut, dataType, proj):
         'OUTPUT': pathOut
     })
 
-def convertSagaRasterToTif(pathIn, pathOut, proj, dataType=None):
-    if dataType == None:
-        processing.run('gdal:translate', {
+@instrumented('layerstools')
+def convertSagaRasterToTif(pathIn, pathOut, proj, dataType=None, backend=None):
+    if getBackend(backend, pathIn, pathOut) == 'gdal':
+        translate(pathIn, pathOut, proj, '', dataType)
+    elif dataType == None:
+        runProcessing('gdal:translate', {
             'INPUT': pathIn,
-            'OPTIONS': '',
+            'OPTIONS': processingOptions(pathOut, source=pathIn),
             #'DATA_TYPE':6,
             'TARGET_CRS': proj,
             'NODATA': None,
@@ -100,9 +507,9 @@ def convertSagaRasterToTif(pathIn, pathOut, proj, dataType=None):
             'OUTPUT': pathOut
         })
     else:
-        processing.run('gdal:translate', {
+        runProcessing('gdal:translate', {
             'INPUT': pathIn,
-            'OPTIONS': '',
+            'OPTIONS': processingOptions(pathOut, dataTypeByName(TRANSLATE_TYPES[dataType])),
             'DATA_TYPE': dataType,
             'TARGET_CRS': proj,
             'NODATA': None,
@@ -110,108 +517,294 @@ def convertSagaRasterToTif(pathIn, pathOut, proj, dataType=None):
             'OUTPUT': pathOut
         })
 
-'''
-PCRaster directions (with lddcreate)
-7 8 9
-4 5 6
-1 2 3
+# windows are grouped up to this number of cells when the natural block is a single strip
+STRIP_WINDOW_CELLS = 1 << 22
 
-Saga directions (with fillsinkswangliu)
-7  0  1
-6 -1  2
-5  4  3
-'''
-def convertLddDirectionsSagaToPcRaster(raster_in_path, raster_out_path):
-    processing.run('gdal:rastercalculator', {
-        'BAND_A': 1,
-        'FORMULA': '((A==-1)*5) + ((A==0)*8) + ((A==1)*9) + ((A==2)*6) + ((A==3)*3) + '+
-                    '((A==4)*2) + ((A==5)*1) + ((A==6)*4) + ((A==7)*7)',
-        'INPUT_A': raster_in_path,
-        'NO_DATA': None,
-        'OPTIONS': '',
-        'OUTPUT': raster_out_path,
-        'RTYPE': 5
-    })
+# yield (xoff, yoff, xsize, ysize) windows covering a band, following its natural
+# block size or square tiles of tileSize pixels
+def rasterWindows(band, tileSize=None):
+    width = band.XSize
+    height = band.YSize
+    if tileSize:
+        blockX, blockY = tileSize, tileSize
+    else:
+        blockX, blockY = band.GetBlockSize()
+        if blockX >= width:
+            blockY = max(blockY, (STRIP_WINDOW_CELLS // width) // blockY * blockY)
+    for yoff in range(0, height, blockY):
+        ysize = min(blockY, height - yoff)
+        for xoff in range(0, width, blockX):
+            yield xoff, yoff, min(blockX, width - xoff), ysize
 
-def convertLddDirectionsSagaToPcRasterNumpy(raster_in_path, raster_out_path):
+# number of cells of each zone (sub-basin...) of an integer raster, read by blocks.
+# used as the cost of work units by scheduler.scheduleUnits
+@instrumented('layerstools')
+def zoneCellCounts(raster_path):
+    gd = gdal.Open(raster_path)
+    band = gd.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    counts = {}
+    for xoff, yoff, xsize, ysize in rasterWindows(band):
+        data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        if nodata is not None:
+            data = data[data != nodata]
+        zones, zoneCounts = np.unique(data, return_counts=True)
+        for zone, count in zip(zones.tolist(), zoneCounts.tolist()):
+            counts[zone] = counts.get(zone, 0) + count
+    gd = None
+    return counts
+
+# read-transform-write pipeline with bounded memory:
+# blockFunction(array, inNodata) is called on each window and returns the output window
+@instrumented('layerstools')
+def processRasterByBlocks(raster_in_path, raster_out_path, blockFunction, outDataType=None, outNodata=None, tileSize=None):
     inGd = gdal.Open(raster_in_path)
     inband1 = inGd.GetRasterBand(1)
-    indata1 = BandReadAsArray(inband1)
     inNodata = inband1.GetNoDataValue()
+    if outDataType is None:
+        outDataType = inband1.DataType
+    if outNodata is None:
+        outNodata = inNodata
 
-    convArr = {
-        -1: 5,
-        0: 8,
-        1: 9,
-        2: 6,
-        3: 3,
-        4: 2,
-        5: 1,
-        6: 4,
-        7: 7,
-        inNodata: inNodata
-    }
-
-    indata1 = np.vectorize(convArr.get, otypes=[float])(indata1)
-    indata1[np.isnan(indata1)] = inNodata
-
-    driver = gdal.GetDriverByName('GTiff')
-    resOut = driver.Create(raster_out_path, inGd.RasterXSize, inGd.RasterYSize, 1, inband1.DataType)
+    # writing square windows in a striped file would rewrite strips, use matching tiles.
+    # the other way around, compressed tiles must be written once so windows follow them
+    options = []
+    if tileSize and tileSize % 16 == 0:
+        options = ['TILED=YES', 'BLOCKXSIZE=%d' % tileSize, 'BLOCKYSIZE=%d' % tileSize]
+    options = creationOptions(raster_out_path, outDataType, options)
+    if not tileSize and 'TILED=YES' in options:
+        tileSize = int([o for o in options if o.startswith('BLOCKXSIZE=')][0].split('=')[1])
+    driver = gdal.GetDriverByName(gdalFormatFromPath(raster_out_path))
+    resOut = driver.Create(raster_out_path, inGd.RasterXSize, inGd.RasterYSize, 1, outDataType, options)
+    if resOut is None:
+        raise Exception('Could not create %s' % raster_out_path)
     CopyDatasetInfo(inGd, resOut)
     bandOut = resOut.GetRasterBand(1)
-    bandOut.SetNoDataValue(inNodata)
-    BandWriteArray(bandOut, indata1)
+    if outNodata is not None:
+        bandOut.SetNoDataValue(outNodata)
+
+    for xoff, yoff, xsize, ysize in rasterWindows(inband1, tileSize):
+        block = inband1.ReadAsArray(xoff, yoff, xsize, ysize)
+        bandOut.WriteArray(blockFunction(block, inNodata), xoff, yoff)
+    bandOut.FlushCache()
 
     inGd = None
     inband1 = None
     resOut = None
     bandOut = None
 
+# per-unit rasters (one per sub-basin...) written by the steps, named <prefix>_<number>.tif.
+# only these prefixes are mosaicked, other names ending with digits (landuse2.tif...) are distinct rasters
+UNIT_RASTER_PREFIXES = ['step2_subbasin', 'step2_mask', 'step3_hru']
+UNIT_RASTER_PATTERN = re.compile(r'^(?P<prefix>%s)_(?P<unit>\d+)\.tif$' % '|'.join(re.escape(p) for p in UNIT_RASTER_PREFIXES))
+
+# {(directory, prefix): paths} for the per-unit rasters, units alone under their prefix are not grouped
+def groupUnitRasters(paths):
+    groups = {}
+    for path in paths:
+        match = UNIT_RASTER_PATTERN.match(os.path.basename(path))
+        if match:
+            groups.setdefault((os.path.dirname(path), match.group('prefix')), []).append(path)
+    return {key: sorted(group) for key, group in groups.items() if len(group) > 1}
+
+# expose per-unit rasters as a single raster without copying any pixel,
+# they must have the same resolution, data type and projection
+@instrumented('layerstools')
+def buildMosaic(raster_paths, vrt_path, nodata=None):
+    if nodata is None:
+        nodata = rasterNodata(raster_paths[0])
+    if nodata is None:
+        options = gdal.BuildVRTOptions()
+    else:
+        options = gdal.BuildVRTOptions(srcNodata=nodata, VRTNodata=nodata)
+    vrt = gdal.BuildVRT(vrt_path, list(raster_paths), options=options)
+    if vrt is None:
+        raise Exception('Could not build mosaic %s' % vrt_path)
+    vrt = None
+
+def rasterNodata(path):
+    gd = gdal.Open(path)
+    return gd.GetRasterBand(1).GetNoDataValue()
+
+# physical merge of a mosaic, only done when it must leave the project (export)
+@instrumented('layerstools')
+def materializeMosaic(vrt_path, raster_out_path):
+    translate(vrt_path, raster_out_path, None)
+
+# overview factors until the smallest overview fits in minSize pixels
+def overviewLevels(width, height, minSize=256):
+    levels = []
+    factor = 2
+    while max(width, height) // factor >= minSize:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+OVERVIEW_CONFIG = {
+    'COMPRESS_OVERVIEW': 'DEFLATE',
+    'BIGTIFF_OVERVIEW': 'IF_SAFER',
+}
+
+# build external (.ovr) overviews so big rasters display quickly at any zoom.
+# the raster itself is not modified, its step cache fingerprint stays valid.
+# returns False if nothing was built (up to date, internal overviews, small raster, canceled)
+@instrumented('layerstools')
+def buildOverviews(raster_path, resampling='NEAREST', minSize=256, callback=None):
+    ovrPath = raster_path + '.ovr'
+    if os.path.exists(ovrPath):
+        if os.path.getmtime(ovrPath) >= os.path.getmtime(raster_path):
+            return False
+        # left by a previous version of the raster
+        os.remove(ovrPath)
+    gd = gdal.Open(raster_path, gdal.GA_ReadOnly)
+    if gd is None or gd.GetRasterBand(1).GetOverviewCount() > 0:
+        return False
+    levels = overviewLevels(gd.RasterXSize, gd.RasterYSize, minSize)
+    if not levels:
+        return False
+    for key, value in OVERVIEW_CONFIG.items():
+        gdal.SetThreadLocalConfigOption(key, value)
+    try:
+        result = gd.BuildOverviews(resampling, levels, callback)
+    finally:
+        for key in OVERVIEW_CONFIG:
+            gdal.SetThreadLocalConfigOption(key, None)
+    gd = None
+    if result != 0:
+        if os.path.exists(ovrPath):
+            os.remove(ovrPath)
+        return False
+    return True
+
 '''
+PCRaster directions (with lddcreate)
+7 8 9
+4 5 6
+1 2 3
+
+Saga directions (with fillsinkswangliu)
+7  0  1
+6 -1  2
+5  4  3
+
 Grass directions (r.fill.dir with 'grass' output format)
 135  90  45
 180      360
 225  270 315
-'''
-def convertLddDirectionsGrassToPcRaster(raster_in_path, raster_out_path):
-    processing.run('gdal:rastercalculator', {
-        'BAND_A': 1,
-        'FORMULA': '((A==90)*8) + ((A==45)*9) + ((A==360)*6) + ((A==315)*3) + '+
-                    '((A==270)*2) + ((A==225)*1) + ((A==180)*4) + ((A==135)*7)',
-        'INPUT_A': raster_in_path,
-        'NO_DATA': 255,
-        'OPTIONS': '',
-        'OUTPUT': raster_out_path,
-        'RTYPE': 5
-    })
 
-'''
 Grass directions (r.watershed drainage output format)
 3  2  1
 4  0  8
 5  6  7
 '''
+LDD_NODATA = 255
+
+LDD_ENCODINGS = {
+    'saga': {-1: 5, 0: 8, 1: 9, 2: 6, 3: 3, 4: 2, 5: 1, 6: 4, 7: 7},
+    'grass': {90: 8, 45: 9, 360: 6, 315: 3, 270: 2, 225: 1, 180: 4, 135: 7},
+    'grassWatershed': {1: 9, 2: 8, 3: 7, 4: 4, 5: 1, 6: 2, 7: 3, 8: 6, 0: 5},
+    'pcraster': {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6, 7: 7, 8: 8, 9: 9},
+}
+
+# integer lookup table indexed by (value - offset), unknown values give LDD_NODATA
+def buildLddLookupTable(conversionTable):
+    offset = min(conversionTable)
+    lut = np.full(max(conversionTable) - offset + 1, LDD_NODATA, dtype=np.uint8)
+    for value, direction in conversionTable.items():
+        lut[value - offset] = direction
+    return lut, offset
+
+LDD_LOOKUP_TABLES = {name: buildLddLookupTable(table) for name, table in LDD_ENCODINGS.items()}
+
+def remapLddDirectionsArray(data, encoding, inNodata=None):
+    lut, offset = LDD_LOOKUP_TABLES[encoding]
+    # only integral values inside the table range are directions
+    if np.issubdtype(data.dtype, np.floating):
+        valid = np.isfinite(data) & (data == np.floor(data))
+    else:
+        valid = np.ones(data.shape, dtype=bool)
+    if inNodata is not None:
+        valid &= (data != inNodata)
+    index = np.where(valid, data, offset).astype(np.int64) - offset
+    valid &= (index >= 0) & (index < lut.size)
+
+    result = np.full(data.shape, LDD_NODATA, dtype=np.uint8)
+    result[valid] = lut[index[valid]]
+    return result
+
+# one engine for all direction conversions, output is uint8 with LDD_NODATA as nodata
+@instrumented('layerstools')
+def remapLddDirections(raster_in_path, raster_out_path, encoding, tileSize=None):
+    processRasterByBlocks(raster_in_path, raster_out_path,
+        lambda block, inNodata: remapLddDirectionsArray(block, encoding, inNodata),
+        gdal.GDT_Byte, LDD_NODATA, tileSize)
+
+@instrumented('layerstools')
+def convertLddDirectionsSagaToPcRaster(raster_in_path, raster_out_path):
+    remapLddDirections(raster_in_path, raster_out_path, 'saga')
+
+@instrumented('layerstools')
+def convertLddDirectionsSagaToPcRasterNumpy(raster_in_path, raster_out_path):
+    remapLddDirections(raster_in_path, raster_out_path, 'saga')
+
+@instrumented('layerstools')
+def convertLddDirectionsGrassToPcRaster(raster_in_path, raster_out_path):
+    remapLddDirections(raster_in_path, raster_out_path, 'grass')
+
+@instrumented('layerstools')
 def convertLddDirectionsGrassWatershedToPcRaster(raster_in_path, raster_out_path):
-    processing.run('gdal:rastercalculator', {
-        'BAND_A': 1,
-        'FORMULA': '((A==1)*9) + ((A==2)*8) + ((A==3)*7) + ((A==4)*4) + '+
-                    '((A==5)*1) + ((A==6)*2) + ((A==7)*3) + ((A==8)*6) + ((A==0)*5)',
-        'INPUT_A': raster_in_path,
-        'NO_DATA': 0,
-        'OPTIONS': '',
-        'OUTPUT': raster_out_path,
-        'RTYPE': 5
-    })
+    remapLddDirections(raster_in_path, raster_out_path, 'grassWatershed')
+
+# value converted to dtype, an error if it does not fit (-9999 in a Byte raster...)
+def castFillValue(value, dtype):
+    value = float(value)
+    if np.issubdtype(dtype, np.integer):
+        limits = np.iinfo(dtype)
+        if value != np.floor(value) or value < limits.min or value > limits.max:
+            raise Exception('Fill value %s does not fit in a %s raster' % (value, np.dtype(dtype).name))
+    elif np.isfinite(value) and abs(value) > np.finfo(dtype).max:
+        raise Exception('Fill value %s does not fit in a %s raster' % (value, np.dtype(dtype).name))
+    return np.asarray(value).astype(dtype)
+
+# nodata cells (and NaN of floating rasters) of a block replaced by value
+def fillNoDataArray(data, inNodata, value):
+    nulls = np.zeros(data.shape, dtype=bool)
+    if inNodata is not None:
+        nulls |= (data == inNodata)
+    if np.issubdtype(data.dtype, np.floating):
+        nulls |= np.isnan(data)
+    result = data.copy()
+    result[nulls] = castFillValue(value, data.dtype)
+    return result
+
+# same as r.null null=value: nodata cells take value and the output has no nodata.
+# the raster is streamed by blocks in-process (gdal backend, the default whatever DEFAULT_BACKEND),
+# r.null only runs when the grass or processing backend is asked or when GDAL can't read the input
+@instrumented('layerstools')
+def fillNoData(raster_in, raster_out, value, backend=None):
+    inGd = gdal.Open(raster_in)
+    if getBackend(backend or 'gdal', raster_in, raster_out) in ['grass', 'processing'] or inGd is None:
+        fillNoDataGrass(raster_in, raster_out, value)
+        return
+    # fail before writing anything
+    castFillValue(value, GDALTypeCodeToNumericTypeCode(inGd.GetRasterBand(1).DataType))
+    inGd = None
+    processRasterByBlocks(raster_in, raster_out,
+        lambda block, inNodata: fillNoDataArray(block, inNodata, value))
+    outGd = gdal.Open(raster_out, gdal.GA_Update)
+    outGd.GetRasterBand(1).DeleteNoDataValue()
+    outGd = None
 
-def fillNoData(raster_in, raster_out, value):
-    processing.run('grass7:r.null', {
+@instrumented('layerstools')
+def fillNoDataGrass(raster_in, raster_out, value):
+    runProcessing('grass7:r.null', {
         '-c': False,
         '-f': False,
         '-i': False,
         '-n': False,
         '-r': False,
         'GRASS_RASTER_FORMAT_META': '',
-        'GRASS_RASTER_FORMAT_OPT': '',
+        'GRASS_RASTER_FORMAT_OPT': ','.join(creationOptions(raster_out, source=raster_in)),
         'GRASS_REGION_CELLSIZE_PARAMETER': 0,
         'GRASS_REGION_PARAMETER': None,
         'map': raster_in,
@@ -220,55 +813,333 @@ def fillNoData(raster_in, raster_out, value):
         'setnull': ''
     })
 
+@instrumented('layerstools')
 def batchConvertToPCRasterFormat(path_in, path_out, proj_info):
-    in_raster = gdal.Open(path_in)
-    driver = gdal.GetDriverByName('PCRaster')
-    out_ds = driver.CreateCopy(path_out, in_raster)
-    out_ds.SetProjection(proj_info)
-    out_ds.FlushCache()
+    # the value scale follows the data type of path_in
+    writePCRasterMap(path_in, path_out, None, proj_info)
 
-def reproject(model, pathIn, pathOut, proj):
+# warping is only done when the raster is not already exactly on the model grid in proj
+@instrumented('layerstools')
+def reproject(model, pathIn, pathOut, proj, backend=None):
     pixelXsize = model.rasterUnitsPerPixelX()
     pixelYsize = model.rasterUnitsPerPixelY()
-    processing.run('gdal:warpreproject', {
+
+    if sameCrs(modelCrs(model), proj) and gridMatches(model, pathIn):
+        copyRasterWindow(pathIn, pathOut)
+        return
+
+    if getBackend(backend, pathIn, pathOut) == 'gdal':
+        deleteRaster(pathOut)
+        gdal.Warp(pathOut, pathIn,
+            format=gdalFormatFromPath(pathOut),
+            creationOptions=creationOptions(pathOut, source=pathIn),
+            dstSRS=proj,
+            xRes=pixelXsize,
+            yRes=pixelYsize,
+            resampleAlg='near'
+        )
+        return
+
+    runProcessing('gdal:warpreproject', {
         'INPUT': pathIn,
         'WIDTH': pixelXsize,
         'HEIGHT': pixelYsize,
         'TARGET_CRS': proj,
         'NODATA': None,
+        'OPTIONS': processingOptions(pathOut, source=pathIn),
         'OUTPUT': pathOut
     })
 
-# this was easy but does not work anymore on QGIS 3.10.1 on Windows...seriously?
+OGR_FORMATS = {
+    '.gpkg': 'GPKG',
+    '.fgb': 'FlatGeobuf',
+    '.shp': 'ESRI Shapefile',
+}
+
+POLYGONIZE_TILE_SIZE = 2048
+
+def createVectorLayer(vectorPath, proj, geometryType, layerName=None):
+    driverName = OGR_FORMATS.get(os.path.splitext(vectorPath)[1].lower(), 'ESRI Shapefile')
+    driver = ogr.GetDriverByName(driverName)
+    if os.path.exists(vectorPath):
+        driver.DeleteDataSource(vectorPath)
+    ds = driver.CreateDataSource(vectorPath)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(proj)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    if layerName is None:
+        layerName = os.path.splitext(os.path.basename(vectorPath))[0]
+    # GeoPackage and FlatGeobuf have a spatial index by default
+    options = ['SPATIAL_INDEX=YES'] if driverName == 'ESRI Shapefile' else []
+    return ds, ds.CreateLayer(layerName, srs, geometryType, options)
+
+# integer types whose values may not fit a 32 bits field
+LARGE_INTEGER_TYPES = [gdal.GDT_UInt32] + [getattr(gdal, name) for name in ['GDT_Int64', 'GDT_UInt64'] if hasattr(gdal, name)]
+
+# polygons of one tile in pixel coordinates of the raster, as (value, geometry, touched inner tile edges).
+# the tile is polygonized as labels (index of each value in the tile) so any data type keeps its exact values,
+# tile edges are whole numbers of pixels so pieces cut by them are detected and merged exactly
+def polygonizeTile(band, xoff, yoff, xsize, ysize, nodata, ignoreZero):
+    data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+    valid = np.ones(data.shape, dtype=np.uint8)
+    if nodata is not None:
+        valid[data == nodata] = 0
+    if np.issubdtype(data.dtype, np.floating):
+        valid[np.isnan(data)] = 0
+    if ignoreZero:
+        valid[data == 0] = 0
+    if not valid.any():
+        return []
+    values, labels = np.unique(data, return_inverse=True)
+
+    memDriver = gdal.GetDriverByName('MEM')
+    dataDs = memDriver.Create('', xsize, ysize, 1, gdal.GDT_Int32)
+    dataDs.SetGeoTransform((xoff, 1, 0, yoff, 0, 1))
+    dataDs.GetRasterBand(1).WriteArray(labels.reshape(data.shape).astype(np.int32))
+    maskDs = memDriver.Create('', xsize, ysize, 1, gdal.GDT_Byte)
+    maskDs.GetRasterBand(1).WriteArray(valid)
+
+    memLayer = ogr.GetDriverByName('Memory').CreateDataSource('').CreateLayer('tile', None, ogr.wkbPolygon)
+    memLayer.CreateField(ogr.FieldDefn('label', ogr.OFTInteger))
+    gdal.Polygonize(dataDs.GetRasterBand(1), maskDs.GetRasterBand(1), memLayer, 0, [], callback=None)
+
+    polygons = []
+    for feature in memLayer:
+        geometry = feature.GetGeometryRef().Clone()
+        minX, maxX, minY, maxY = geometry.GetEnvelope()
+        edges = set()
+        if xoff > 0 and minX == xoff:
+            edges.add('left')
+        if xoff + xsize < band.XSize and maxX == xoff + xsize:
+            edges.add('right')
+        if yoff > 0 and minY == yoff:
+            edges.add('top')
+        if yoff + ysize < band.YSize and maxY == yoff + ysize:
+            edges.add('bottom')
+        polygons.append((values[feature.GetField(0)].item(), geometry, edges))
+    return polygons
+
+# polygons of the union of the pieces of one value
+def unionPolygons(pieces):
+    collection = ogr.Geometry(ogr.wkbMultiPolygon)
+    for piece in pieces:
+        collection.AddGeometry(piece)
+    union = collection.UnionCascaded()
+    if union.GetGeometryType() == ogr.wkbPolygon:
+        return [union]
+    return [union.GetGeometryRef(i).Clone() for i in range(union.GetGeometryCount())]
+
+# move a polygon from pixel to georeferenced coordinates
+def applyGeoTransform(polygon, geoTransform):
+    for i in range(polygon.GetGeometryCount()):
+        ring = polygon.GetGeometryRef(i)
+        for j in range(ring.GetPointCount()):
+            x, y = ring.GetPoint_2D(j)
+            ring.SetPoint_2D(j,
+                geoTransform[0] + x * geoTransform[1] + y * geoTransform[2],
+                geoTransform[3] + x * geoTransform[4] + y * geoTransform[5])
+    return polygon
+
+# vectorization engine: the raster is polygonized by tiles with bounded memory, in pixel coordinates.
+# Pieces touching an inner tile edge are kept by value until no piece of their value reaches
+# the bottom of the current row of tiles, they are then merged in one union.
+# The geotransform is applied once to each output polygon.
+# the output format comes from the extension (.gpkg, .fgb or .shp), features are written in one transaction.
+# pixels equal to nodata (and to 0 with ignoreZero) are not vectorized
+@instrumented('layerstools')
+def polygonizeRaster(rasterPath, vectorPath, proj, field='DN', ignoreZero=False, layerName=None, tileSize=POLYGONIZE_TILE_SIZE):
+    gd = gdal.Open(rasterPath)
+    band = gd.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    geoTransform = gd.GetGeoTransform()
+
+    ds, layer = createVectorLayer(vectorPath, proj, ogr.wkbPolygon, layerName)
+    if band.DataType in FLOAT_TYPES:
+        fieldType = ogr.OFTReal
+    elif band.DataType in LARGE_INTEGER_TYPES:
+        fieldType = ogr.OFTInteger64
+    else:
+        fieldType = ogr.OFTInteger
+    layer.CreateField(ogr.FieldDefn(field, fieldType))
+    layerDefn = layer.GetLayerDefn()
+    useTransaction = ds.TestCapability(ogr.ODsCTransactions)
+    if useTransaction:
+        ds.StartTransaction()
+
+    def writePolygon(value, geometry):
+        feature = ogr.Feature(layerDefn)
+        feature.SetField(field, value)
+        feature.SetGeometry(applyGeoTransform(geometry, geoTransform))
+        layer.CreateFeature(feature)
+
+    # values of the pieces still growing in the next row of tiles are kept, the others are merged
+    def flushPieces(growing):
+        for value in [v for v in cutPieces if v not in growing]:
+            for polygon in unionPolygons(cutPieces.pop(value)):
+                writePolygon(value, polygon)
+
+    # pieces cut by tile edges, by value
+    cutPieces = {}
+    # values with a piece reaching the bottom of the current row of tiles
+    growing = set()
+    rowYoff = None
+    for xoff, yoff, xsize, ysize in rasterWindows(band, tileSize):
+        if rowYoff is not None and yoff != rowYoff:
+            flushPieces(growing)
+            growing = set()
+        rowYoff = yoff
+        for value, geometry, edges in polygonizeTile(band, xoff, yoff, xsize, ysize, nodata, ignoreZero):
+            if not edges:
+                writePolygon(value, geometry)
+                continue
+            cutPieces.setdefault(value, []).append(geometry)
+            if 'bottom' in edges:
+                growing.add(value)
+    flushPieces(set())
+
+    if useTransaction:
+        ds.CommitTransaction()
+    ds = None
+    gd = None
+
+# processing gdal:polygonize did not work anymore on QGIS 3.10.1 on Windows, both use the native engine now
+@instrumented('layerstools')
 def convertToShapefile(raster, vector, proj):
-    processing.run('gdal:polygonize', {
-        'INPUT': raster,
-        'BAND': 1,
-        'FIELD': 'DN',
-        'TARGET_CRS': proj,
-        'EIGHT_CONNECTEDNESS': False,
-        'OUTPUT': vector
-    })
+    polygonizeRaster(raster, vector, proj, 'DN')
 
-# reliable way to vectorize a raster
+# catchment map: 0 is outside the catchments
+@instrumented('layerstools')
 def convertToShapefileGdal(inputRasterPath, outputVectorPath, dem_proj):
-    raster_rs  = gdal.Open(inputRasterPath)
-    catch_band    = raster_rs.GetRasterBand(1)
-    drv           = ogr.GetDriverByName('ESRI Shapefile')
-    catchment_ds  = drv.CreateDataSource(outputVectorPath)
-    spat_ref      = osr.SpatialReference()
-    spat_ref.ImportFromWkt(dem_proj)
-    catch_layer   = catchment_ds.CreateLayer('catchment', spat_ref, ogr.wkbPolygon)
-    field         = ogr.FieldDefn('ID', ogr.OFTInteger)
-    catch_layer.CreateField(field)
-    catch_band.FlushCache()
-    gdal.Polygonize(catch_band, catch_band, catch_layer, 0, [], callback=None )  # using the catchment map as a mask (2nd arg)
-    catchment_ds.Destroy()
-    raster_rs = None
-    catch_band = None
-
-def clipRasterWithShape(rasterIn, mask, rasterOut, sourceCrs=None, nodata=''):
-    processing.run('gdal:cliprasterbymasklayer', {
+    polygonizeRaster(inputRasterPath, outputVectorPath, dem_proj, 'ID', ignoreZero=True, layerName='catchment')
+
+# value given to the pixels outside the mask when the raster has no nodata
+def defaultNodata(dataType):
+    if dataType == gdal.GDT_Byte:
+        return 255
+    if dataType == gdal.GDT_UInt16:
+        return 65535
+    return -9999
+
+# clip a raster many times with the features of one mask file: the mask is read once,
+# each clip reads only the raster window covering the feature and writes the cropped output directly.
+# features are identified by their FID or by the value of idField
+class MaskClipper:
+    def __init__(self, maskPath, idField=None):
+        ds = ogr.Open(maskPath)
+        layer = ds.GetLayer(0)
+        self.maskPath = maskPath
+        self.srs = layer.GetSpatialRef()
+        self.geometries = {}
+        for feature in layer:
+            featureId = feature.GetFID() if idField is None else feature.GetField(idField)
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            self.geometries[featureId] = geometry.ExportToWkb()
+        ds = None
+        self.transforms = {}
+
+    # feature geometry in the raster projection
+    def geometry(self, featureId, rasterWkt):
+        geometry = ogr.CreateGeometryFromWkb(self.geometries[featureId])
+        if self.srs is not None and rasterWkt:
+            if rasterWkt not in self.transforms:
+                rasterSrs = osr.SpatialReference(wkt=rasterWkt)
+                rasterSrs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                self.srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                self.transforms[rasterWkt] = None if self.srs.IsSame(rasterSrs) else osr.CoordinateTransformation(self.srs, rasterSrs)
+            if self.transforms[rasterWkt] is not None:
+                geometry.Transform(self.transforms[rasterWkt])
+        return geometry
+
+    # returns False if the feature does not overlap the raster.
+    # sourceCrs overrides the projection of rasterIn, like SOURCE_CRS of gdal:cliprasterbymasklayer
+    def clip(self, rasterIn, rasterOut, featureId, nodata=None, sourceCrs=None):
+        inGd = gdal.Open(rasterIn)
+        band = inGd.GetRasterBand(1)
+        gt = inGd.GetGeoTransform()
+        rasterWkt = inGd.GetProjection()
+        if sourceCrs:
+            srs = osr.SpatialReference()
+            srs.SetFromUserInput(sourceCrs)
+            rasterWkt = srs.ExportToWkt()
+        geometry = self.geometry(featureId, rasterWkt)
+        xmin, xmax, ymin, ymax = geometry.GetEnvelope()
+
+        # pixel window covering the feature envelope (north-up rasters)
+        xoff = max(int(np.floor((xmin - gt[0]) / gt[1])), 0)
+        yoff = max(int(np.floor((ymax - gt[3]) / gt[5])), 0)
+        xend = min(int(np.ceil((xmax - gt[0]) / gt[1])), inGd.RasterXSize)
+        yend = min(int(np.ceil((ymin - gt[3]) / gt[5])), inGd.RasterYSize)
+        if xend <= xoff or yend <= yoff:
+            return False
+        xsize = xend - xoff
+        ysize = yend - yoff
+        windowTransform = (gt[0] + xoff * gt[1], gt[1], 0, gt[3] + yoff * gt[5], 0, gt[5])
+
+        # rasterize the feature on the window
+        memDs = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Byte)
+        memDs.SetGeoTransform(windowTransform)
+        memVector = ogr.GetDriverByName('Memory').CreateDataSource('')
+        memLayer = memVector.CreateLayer('mask', None, ogr.wkbUnknown)
+        feature = ogr.Feature(memLayer.GetLayerDefn())
+        feature.SetGeometry(geometry)
+        memLayer.CreateFeature(feature)
+        gdal.RasterizeLayer(memDs, [1], memLayer, burn_values=[1])
+        inside = memDs.GetRasterBand(1).ReadAsArray() == 1
+
+        if nodata in ('', None):
+            nodata = band.GetNoDataValue()
+        if nodata is None:
+            nodata = defaultNodata(band.DataType)
+        data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        data[~inside] = castFillValue(nodata, data.dtype)
+
+        deleteRaster(rasterOut)
+        driver = gdal.GetDriverByName(gdalFormatFromPath(rasterOut))
+        outGd = driver.Create(rasterOut, xsize, ysize, 1, band.DataType, creationOptions(rasterOut, band.DataType))
+        outGd.SetGeoTransform(windowTransform)
+        outGd.SetProjection(rasterWkt)
+        outBand = outGd.GetRasterBand(1)
+        outBand.SetNoDataValue(float(nodata))
+        outBand.WriteArray(data)
+        outBand.FlushCache()
+        outGd = None
+        inGd = None
+        return True
+
+# clippers are kept while their mask file does not change
+maskClippers = {}
+
+def getMaskClipper(mask, idField=None):
+    key = (os.path.abspath(mask), idField)
+    mtime = os.path.getmtime(mask)
+    if key not in maskClippers or maskClippers[key][0] != mtime:
+        maskClippers[key] = (mtime, MaskClipper(mask, idField))
+    return maskClippers[key][1]
+
+# with featureId, only this feature of the mask is used (see MaskClipper), the clip is done in-process
+# whatever the backend and only reads the raster window covering the feature
+@instrumented('layerstools')
+def clipRasterWithShape(rasterIn, mask, rasterOut, sourceCrs=None, nodata='', backend=None, featureId=None, idField=None):
+    if featureId is not None:
+        if not getMaskClipper(mask, idField).clip(rasterIn, rasterOut, featureId, nodata, sourceCrs):
+            raise Exception('Feature %s of %s does not overlap %s' % (featureId, mask, rasterIn))
+        return
+
+    if getBackend(backend, rasterIn, rasterOut) == 'gdal':
+        deleteRaster(rasterOut)
+        gdal.Warp(rasterOut, rasterIn,
+            format=gdalFormatFromPath(rasterOut),
+            creationOptions=creationOptions(rasterOut, source=rasterIn),
+            cutlineDSName=mask,
+            cropToCutline=True,
+            srcSRS=sourceCrs,
+            dstNodata=None if nodata in ('', None) else nodata
+        )
+        return
+
+    runProcessing('gdal:cliprasterbymasklayer', {
         'INPUT': rasterIn,
         'MASK': mask,
         'NODATA': nodata,
@@ -276,15 +1147,18 @@ def clipRasterWithShape(rasterIn, mask, rasterOut, sourceCrs=None, nodata=''):
         'ALPHA_BAND': False,
         'CROP_TO_CUTLINE': True,
         'KEEP_RESOLUTION': False,
+        'OPTIONS': processingOptions(rasterOut, source=rasterIn),
         'OUTPUT': rasterOut
     })
 
+@instrumented('layerstools')
 def fixGeometry(shapeIn, shapeOut):
-    processing.run('native:fixgeometries', {
+    runProcessing('native:fixgeometries', {
         'INPUT': shapeIn,
         'OUTPUT': shapeOut
     })
 
+@instrumented('layerstools')
 def pixelsToPoints(rasterInputPath, outShapePath):
     params = {
         'INPUT_RASTER': rasterInputPath,
@@ -292,4 +1166,4 @@ def pixelsToPoints(rasterInputPath, outShapePath):
         'FIELD_NAME': 'VALUE',
         'OUTPUT': outShapePath
     }
-    processing.run('qgis:pixelstopoints', params)
+    runProcessing('qgis:pixelstopoints', params)
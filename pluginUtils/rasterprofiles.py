@@ -0,0 +1,46 @@
+import os
+
+# GeoTIFF creation options used for every raster written by the plugin.
+# 'default' keeps GDAL defaults (striped, uncompressed) and the outputs identical to previous versions,
+# the others write tiled compressed files, which are much smaller and faster to read by window or for display.
+# compression runs in the writing thread: rasters are often written by pool workers, one per core already
+PROFILE_ENV = 'HRUDELIN_RASTER_PROFILE'
+DEFAULT_PROFILE = 'default'
+
+TILED_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'BIGTIFF=IF_SAFER']
+CREATION_PROFILES = {
+    'default': [],
+    'tiled': TILED_OPTIONS,
+    'deflate': TILED_OPTIONS + ['COMPRESS=DEFLATE', 'ZLEVEL=6'],
+    'zstd': TILED_OPTIONS + ['COMPRESS=ZSTD', 'ZSTD_LEVEL=1'],
+}
+PROFILE_NAMES = ['default', 'tiled', 'deflate', 'zstd']
+
+# the profile is read from the environment so it is inherited by step processes and their workers
+def currentProfileName():
+    name = os.environ.get(PROFILE_ENV, DEFAULT_PROFILE)
+    return name if name in CREATION_PROFILES else DEFAULT_PROFILE
+
+def setProfileName(name):
+    if name not in CREATION_PROFILES:
+        raise Exception('Unknown raster profile %s, choose one of %s' % (name, ', '.join(PROFILE_NAMES)))
+    os.environ[PROFILE_ENV] = name
+
+compressionSupport = {}
+
+# ZSTD depends on the GDAL build
+def compressionSupported(compression):
+    if compression not in compressionSupport:
+        from osgeo import gdal
+        optionList = gdal.GetDriverByName('GTiff').GetMetadataItem('DMD_CREATIONOPTIONLIST') or ''
+        compressionSupport[compression] = compression in optionList
+    return compressionSupport[compression]
+
+# creation options of the current profile for a GeoTIFF, the predictor depends on the data type
+def profileCreationOptions(floating=False, name=None):
+    options = list(CREATION_PROFILES[name or currentProfileName()])
+    if 'COMPRESS=ZSTD' in options and not compressionSupported('ZSTD'):
+        options = CREATION_PROFILES['deflate'][:]
+    if any(o.startswith('COMPRESS=') for o in options):
+        options.append('PREDICTOR=3' if floating else 'PREDICTOR=2')
+    return options
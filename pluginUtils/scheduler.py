@@ -0,0 +1,58 @@
+import os, time
+from collections.abc import Mapping
+from hrudelin.pluginUtils.instrumentation import measure
+
+# Sub-basins differ in size by orders of magnitude, a static partition of the work list
+# (split_list) leaves workers idle while one of them processes the biggest basins.
+# Here work units are dispatched one by one, largest first: the long units start early
+# and each worker takes the next unit as soon as it is free.
+
+# units sorted by decreasing cost, costs is a list (same order as units), a function(unit)
+# or a mapping {unit: cost} like zoneCellCounts (missing units cost 0)
+def sortByCost(units, costs):
+    if isinstance(costs, Mapping):
+        costs = [costs.get(unit, 0) for unit in units]
+    elif callable(costs):
+        costs = [costs(unit) for unit in units]
+    elif not hasattr(costs, '__getitem__') or len(costs) != len(units):
+        raise TypeError('costs must be a mapping, a function or a sequence with one cost per unit')
+    order = sorted(range(len(units)), key=lambda i: costs[i], reverse=True)
+    return [units[i] for i in order]
+
+# cost of a unit from its bounding box (xmin, ymin, xmax, ymax)
+def bboxCost(bbox):
+    return max(bbox[2] - bbox[0], 0) * max(bbox[3] - bbox[1], 0)
+
+# run in the workers, the pid and times are used to compute their utilization
+def timedCall(args):
+    function, unit = args
+    startTime = time.time()
+    result = function(unit)
+    return os.getpid(), startTime, time.time(), unit, result
+
+# fraction of the wall time each worker spent on units
+def workerUtilization(busyTimes, wall):
+    if not wall:
+        return {}
+    return {str(pid): round(busy / wall, 3) for pid, busy in busyTimes.items()}
+
+# call function(unit) for each unit in the pool (or in this process if pool is None)
+# and yield (unit, result) in completion order.
+# function must be picklable (module level) to be sent to the pool workers.
+# per-worker utilization is recorded in the instrumentation report
+def scheduleUnits(function, units, costs=None, pool=None, name='schedule'):
+    units = list(units)
+    if costs is not None:
+        units = sortByCost(units, costs)
+    tasks = [(function, unit) for unit in units]
+    busyTimes = {}
+    with measure(name, 'scheduler', units=len(units)) as m:
+        if pool is None:
+            results = map(timedCall, tasks)
+        else:
+            # chunks of one unit: no worker gets stuck with a batch of big units
+            results = pool.imap_unordered(timedCall, tasks, 1)
+        for pid, startTime, endTime, unit, result in results:
+            busyTimes[pid] = busyTimes.get(pid, 0) + endTime - startTime
+            yield unit, result
+        m.info['workerUtilization'] = workerUtilization(busyTimes, time.time() - m.startTime)
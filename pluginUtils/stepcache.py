@@ -0,0 +1,188 @@
+import os, json, hashlib, threading, configparser
+from pathlib import Path
+
+MANIFEST_NAME = 'hrudelin_step_cache.json'
+CHECKPOINTS_NAME = 'hrudelin_checkpoints_%s.json'
+
+def fileFingerprint(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+# per-step manifest stored in the cfg 'files' output directory:
+# a step is skipped when the cfg file (all its sections, the steps don't declare what they read), the input files,
+# the outputs of the previous step and its own outputs did not change
+class StepCache:
+    def __init__(self, projectFilePath, filesOutPath, resultsOutPath):
+        self.projectFilePath = projectFilePath
+        self.filesOutPath = filesOutPath
+        self.resultsOutPath = resultsOutPath
+        self.manifestPath = os.path.join(filesOutPath, MANIFEST_NAME)
+
+        self.config = configparser.ConfigParser()
+        self.config.read(projectFilePath)
+
+    def readManifest(self):
+        try:
+            with open(self.manifestPath) as f:
+                return json.load(f)
+        except Exception as e:
+            return {}
+
+    def writeManifest(self, manifest):
+        if not os.path.exists(self.filesOutPath):
+            return
+        with open(self.manifestPath, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    # input files from [files_in], relative to [dir_in], with shapefile sidecars
+    def inputFiles(self):
+        if 'files_in' not in self.config:
+            return []
+        inDir = self.config['dir_in']['dir'] if 'dir_in' in self.config else ''
+        if not os.path.isabs(inDir):
+            inDir = os.path.join(os.path.dirname(self.projectFilePath), inDir)
+        paths = []
+        for key, value in sorted(self.config['files_in'].items()):
+            path = value if os.path.isabs(value) else os.path.join(inDir, value)
+            if not value or not os.path.isfile(path):
+                continue
+            paths.append(path)
+            if path.lower().endswith('.shp'):
+                base = os.path.splitext(path)[0]
+                for ext in ['.dbf', '.shx', '.prj']:
+                    if os.path.isfile(base + ext):
+                        paths.append(base + ext)
+        return paths
+
+    def outputFiles(self, step):
+        if step == 4:
+            root, pattern = self.resultsOutPath, '*'
+        else:
+            root, pattern = self.filesOutPath, '*step%s*' % step
+        if not os.path.exists(root):
+            return []
+        # display overviews are built after the step, they are not outputs
+        return sorted(str(p) for p in Path(root).rglob(pattern) if p.is_file() and p.suffix != '.ovr')
+
+    def signature(self, step, manifest):
+        h = hashlib.sha1()
+        h.update(('step%s' % step).encode('utf-8'))
+        for section in sorted(self.config.sections()):
+            h.update(('[%s]' % section).encode('utf-8'))
+            for key, value in sorted(self.config[section].items()):
+                h.update(('%s=%s' % (key, value)).encode('utf-8'))
+        for path in self.inputFiles():
+            h.update(('%s %s' % (path, fileFingerprint(path))).encode('utf-8'))
+        # a recomputed previous step invalidates this one
+        if step > 1:
+            previous = manifest.get(str(step - 1))
+            if previous is None:
+                return None
+            h.update(json.dumps(previous['outputs'], sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    # signature under which the work units of an interrupted step can be reused
+    def checkpointSignature(self, step):
+        return self.signature(step, self.readManifest())
+
+    def isValid(self, step):
+        manifest = self.readManifest()
+        entry = manifest.get(str(step))
+        if entry is None or not entry['outputs'] or entry['signature'] is None:
+            return False
+        if entry['signature'] != self.signature(step, manifest):
+            return False
+        for path, fingerprint in entry['outputs'].items():
+            if not os.path.isfile(path) or fileFingerprint(path) != fingerprint:
+                return False
+        return True
+
+    # called when a step has successfully finished
+    def store(self, step):
+        manifest = self.readManifest()
+        for s in list(manifest.keys()):
+            if int(s) >= step:
+                del manifest[s]
+        manifest[str(step)] = {
+            'signature': self.signature(step, manifest),
+            'outputs': {path: fileFingerprint(path) for path in self.outputFiles(step)},
+        }
+        self.writeManifest(manifest)
+
+    def invalidate(self, step):
+        manifest = self.readManifest()
+        for s in list(manifest.keys()):
+            if int(s) >= step:
+                del manifest[s]
+        self.writeManifest(manifest)
+
+# manifest and checkpoints of a project, the cleaning of the steps must not remove them
+def cacheFiles(filesOutPath):
+    paths = [os.path.join(filesOutPath, MANIFEST_NAME)]
+    paths += [os.path.join(filesOutPath, CHECKPOINTS_NAME % step) for step in [1, 2, 3, 4]]
+    return set(os.path.normpath(path) for path in paths if os.path.isfile(path))
+
+def fingerprints(paths):
+    return {path: fileFingerprint(path) for path in paths if os.path.isfile(path)}
+
+# work units (sub-basins...) already finished by an interrupted step, so that
+# a restarted step only computes the missing or stale ones.
+# Steps accepting a 'checkpoints' argument get this object and call isDone/markDone
+# from their main process (not from pool workers). The file is removed when the step succeeds.
+class StepCheckpoints:
+    def __init__(self, filesOutPath, step, signature):
+        self.path = os.path.join(filesOutPath, CHECKPOINTS_NAME % step)
+        self.signature = signature
+        self.lock = threading.Lock()
+        self.units = {}
+        if signature is None:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except Exception as e:
+            return
+        if data.get('signature') == signature:
+            self.units = data['units']
+
+    def write(self):
+        if not os.path.exists(os.path.dirname(self.path)):
+            return
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'signature': self.signature, 'units': self.units}, f, indent=1)
+        os.replace(tmpPath, self.path)
+
+    # a unit is done if it was finished with the same input files and its outputs were not modified since
+    def isDone(self, unitId, inputs=()):
+        entry = self.units.get(str(unitId))
+        if entry is None or entry['inputs'] != fingerprints(inputs):
+            return False
+        return self.outputsUnchanged(entry)
+
+    def outputsUnchanged(self, entry):
+        for path, fingerprint in entry['outputs'].items():
+            if not os.path.isfile(path) or fileFingerprint(path) != fingerprint:
+                return False
+        return True
+
+    def markDone(self, unitId, outputs, inputs=()):
+        with self.lock:
+            self.units[str(unitId)] = {
+                'inputs': fingerprints(inputs),
+                'outputs': fingerprints(outputs),
+            }
+            self.write()
+
+    # outputs of the finished units, they must survive the cleaning of the step
+    def keptFiles(self):
+        kept = set()
+        for entry in self.units.values():
+            if self.outputsUnchanged(entry):
+                kept.update(os.path.normpath(path) for path in entry['outputs'])
+        return kept
+
+    def clear(self):
+        self.units = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
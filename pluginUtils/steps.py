@@ -0,0 +1,391 @@
+import os, sys, time, queue, shutil, contextlib, threading, importlib, inspect, traceback, configparser, multiprocessing
+import multiprocessing.spawn
+from pathlib import Path
+
+from hrudelin.pluginUtils.tools import prepareGrassEnv
+from hrudelin.pluginUtils.stepcache import StepCheckpoints, cacheFiles
+from hrudelin.pluginUtils import instrumentation
+
+# hrudelinCore modules need GRASS in the environment when they are imported,
+# callers must run prepareGrassEnv before getting a step entry point
+STEP_MODULES = {
+    1: 'hrudelin.hrudelinCore.modules.hrudelin_1_init',
+    2: 'hrudelin.hrudelinCore.modules.hrudelin_2_basins',
+    3: 'hrudelin.hrudelinCore.modules.hrudelin_3_hrugen',
+    4: 'hrudelin.hrudelinCore.modules.hrudelin_parms_J2000',
+}
+
+def importStepMain(step):
+    return importlib.import_module(STEP_MODULES[step]).main
+
+# read the paths of a project the same way the dock widget does
+def readProjectConfig(projectFilePath):
+    projectFileDir = os.path.dirname(projectFilePath)
+    config = configparser.ConfigParser()
+    config.read(projectFilePath)
+
+    # dir_in is absolute or relative to config file parent directory
+    dir = config['dir_in']['dir']
+    if not os.path.isabs(dir):
+        dir = os.path.join(projectFileDir, dir)
+
+    filesOutPath = config['dir_out']['files']
+    if not os.path.isabs(filesOutPath):
+        filesOutPath = os.path.join(projectFileDir, filesOutPath)
+
+    resultsOutPath = config['dir_out']['results']
+    if not os.path.isabs(resultsOutPath):
+        resultsOutPath = os.path.join(projectFileDir, resultsOutPath)
+
+    return {
+        'projectFilePath': projectFilePath,
+        'projectFileDir': projectFileDir,
+        'demPath': os.path.join(dir, config['files_in']['dem']),
+        'filesOutPath': filesOutPath,
+        'resultsOutPath': resultsOutPath,
+        'tmpPath': os.path.join(projectFileDir, 'tmp'),
+    }
+
+# empty a directory, files in keep (normalized paths) are preserved
+def resetDirectory(path, keep=frozenset()):
+    if keep and os.path.exists(path):
+        for fPath in Path(path).rglob('*'):
+            if fPath.is_file() and os.path.normpath(str(fPath)) not in keep:
+                os.remove(str(fPath))
+        return
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.mkdir(path)
+
+def removeFiles(path, pattern, keep=frozenset()):
+    for fPath in Path(path).rglob(pattern):
+        if os.path.normpath(str(fPath)) not in keep:
+            os.remove(str(fPath))
+
+# do the same job as hrudelin bash script before launching each python module
+# keep: outputs of checkpointed work units that a resumed step will reuse,
+# the step cache manifest and the checkpoint files are always kept
+def cleanStep(step, project, keep=frozenset()):
+    keep = set(keep) | cacheFiles(project['filesOutPath'])
+    if step == 1:
+        resetDirectory(project['filesOutPath'], keep)
+        resetDirectory(project['resultsOutPath'])
+        resetDirectory(project['tmpPath'])
+    elif step == 2:
+        removeFiles(project['filesOutPath'], 'step2*.tif', keep)
+        removeFiles(project['filesOutPath'], 'step3*.tif', keep)
+        resetDirectory(project['resultsOutPath'], keep)
+    elif step == 3:
+        removeFiles(project['filesOutPath'], 'step3*.tif', keep)
+        resetDirectory(project['resultsOutPath'], keep)
+    elif step == 4:
+        resetDirectory(project['resultsOutPath'], keep)
+        removeFiles(project['tmpPath'], 'topolog*', keep)
+
+    # display overviews of the removed rasters
+    if step in [2, 3]:
+        for fPath in Path(project['filesOutPath']).rglob('step*.tif.ovr'):
+            if not os.path.exists(str(fPath)[:-len('.ovr')]):
+                os.remove(str(fPath))
+
+# hrudelinCore steps yield a progress percentage, they can also yield a sub-stage name
+# or a dict with optional 'progress', 'stage' and 'layer' (path of a finalized output)
+def progressEvent(value):
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        return {'stage': value}
+    return {'progress': value}
+
+class StepCanceled(Exception):
+    pass
+
+# seconds given to a canceled step to stop by itself before its processes are killed
+CANCEL_GRACE_DELAY = 2
+
+# seconds an output must stay unchanged to be considered finalized
+OUTPUT_SETTLE_DELAY = 2
+
+# finds the rasters of a running step as they are written in the 'files' directory.
+# a raster is reported once, when its size and modification time did not change for OUTPUT_SETTLE_DELAY.
+# files present before the step (kept units of a resumed step...) are not reported
+class OutputScanner:
+    def __init__(self, directory, pattern):
+        self.directory = directory
+        self.pattern = pattern
+        # path: (fingerprint, time it was first seen with it)
+        self.candidates = {}
+        self.reported = set(self.listOutputs())
+
+    def listOutputs(self):
+        if not os.path.exists(self.directory):
+            return []
+        return [str(p) for p in Path(self.directory).glob(self.pattern)]
+
+    def scan(self):
+        now = time.time()
+        finalized = []
+        for path in self.listOutputs():
+            if path in self.reported:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                continue
+            fingerprint = (st.st_size, st.st_mtime_ns)
+            previous = self.candidates.get(path)
+            if previous is None or previous[0] != fingerprint:
+                self.candidates[path] = (fingerprint, now)
+            elif now - previous[1] >= OUTPUT_SETTLE_DELAY and st.st_size > 0:
+                del self.candidates[path]
+                self.reported.add(path)
+                finalized.append(path)
+        return finalized
+
+# run a step which does not yield its progress in a thread,
+# its outputs are reported while it runs
+def callStepInThread(stepMain, args, kwargs, scanner):
+    outcome = {}
+    def call():
+        try:
+            outcome['result'] = stepMain(*args, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=call, name='hrudelin step', daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(1)
+        for path in scanner.scan():
+            yield {'layer': path}
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+# clean and run a step, yield progress events (see progressEvent)
+# steps accepting a cancelEvent argument check it between their work units,
+# the others are stopped at their next yield.
+# steps accepting a checkpoints argument (see StepCheckpoints) resume an interrupted run,
+# the outputs of their finished work units are not cleaned.
+# steps accepting a pool argument use it instead of starting their own workers
+def runStep(step, project, nbProcess, stepMain=None, cancelEvent=None, checkpoints=None, pool=None):
+    if stepMain is None:
+        stepMain = importStepMain(step)
+    parameters = inspect.signature(stepMain).parameters
+    kwargs = {}
+    if pool is not None and 'pool' in parameters:
+        kwargs['pool'] = pool
+    if cancelEvent is not None and 'cancelEvent' in parameters:
+        kwargs['cancelEvent'] = cancelEvent
+    keep = frozenset()
+    if checkpoints is not None and 'checkpoints' in parameters:
+        kwargs['checkpoints'] = checkpoints
+        keep = checkpoints.keptFiles()
+
+    yield {'stage': 'cleaning previous outputs'}
+    cleanStep(step, project, keep)
+    if keep:
+        yield {'stage': 'resuming step %s (%s files kept)' % (step, len(keep))}
+    else:
+        yield {'stage': 'step %s' % step}
+    # outputs are also reported when they appear, for steps which don't report them
+    scanner = OutputScanner(project['filesOutPath'], 'step%s*.tif' % step)
+    if step == 1:
+        args = (project['projectFilePath'],)
+    else:
+        args = (project['projectFilePath'], nbProcess, True)
+    if inspect.isgeneratorfunction(stepMain):
+        result = stepMain(*args, **kwargs)
+    else:
+        result = yield from callStepInThread(stepMain, args, kwargs, scanner)
+    if inspect.isgenerator(result):
+        # closing the generator lets the step terminate its pools
+        with contextlib.closing(result):
+            for value in result:
+                if cancelEvent is not None and cancelEvent.is_set():
+                    raise StepCanceled('step %s canceled' % step)
+                yield progressEvent(value)
+                for path in scanner.scan():
+                    yield {'layer': path}
+    if cancelEvent is not None and cancelEvent.is_set():
+        raise StepCanceled('step %s canceled' % step)
+    if checkpoints is not None:
+        checkpoints.clear()
+
+# layerstools relies on QGIS processing, initialize it in a process which is not QGIS itself
+# (step host, batch runs). prefixPath is the QGIS installation when it is not found by default
+def initQgis(prefixPath=None):
+    try:
+        from qgis.core import QgsApplication
+    except ImportError:
+        return None
+    if prefixPath:
+        QgsApplication.setPrefixPath(prefixPath, True)
+    app = QgsApplication([], False)
+    app.initQgis()
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+    try:
+        from processing.core.Processing import Processing
+        Processing.initialize()
+    except ImportError:
+        print('QGIS processing not found, processing based tools will not work')
+    return app
+
+# pool initializer, workers import the heavy modules once instead of at each step
+def warmWorker():
+    try:
+        import numpy
+        from osgeo import gdal
+    except ImportError as e:
+        pass
+
+# entry point of the step host process: it keeps a worker pool and runs the steps
+# it receives until it gets None, events are sent to the parent through a queue
+def stepHostMain(requests, events, cancelEvent, nbProcess, grassArgs, environment, qgisPrefixPath):
+    # set while no step is running
+    idle = threading.Event()
+    idle.set()
+
+    # free the cores if a canceled step is blocked (in a pool...): kill the workers and leave.
+    # a step stopping by itself within the grace delay replies and the host exits normally
+    def watchCancel():
+        cancelEvent.wait()
+        if idle.wait(CANCEL_GRACE_DELAY):
+            return
+        for child in multiprocessing.active_children():
+            child.terminate()
+        os._exit(1)
+    threading.Thread(target=watchCancel, daemon=True).start()
+
+    # before starting the workers so they inherit it
+    os.environ.update(environment)
+    prepareGrassEnv(*grassArgs)
+    # the steps run processing algorithms, this process needs its own QGIS
+    app = initQgis(qgisPrefixPath)
+    # the host imports the heavy modules once, its workers are only started
+    # for steps which accept a pool, the others start their own
+    warmWorker()
+    pool = None
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            request = requests.get(timeout=1)
+        except queue.Empty:
+            # QGIS died without shutting us down
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        if request is None:
+            break
+        step, project, checkpointSignature = request
+        idle.clear()
+        try:
+            # measured here to get the cpu and memory of the step, not of QGIS
+            with instrumentation.measure('step %s' % step, 'step', project['demPath'], nbProcess=nbProcess):
+                stepMain = importStepMain(step)
+                if pool is None and 'pool' in inspect.signature(stepMain).parameters:
+                    pool = multiprocessing.Pool(nbProcess, warmWorker)
+                checkpoints = StepCheckpoints(project['filesOutPath'], step, checkpointSignature)
+                for event in runStep(step, project, nbProcess, stepMain, cancelEvent=cancelEvent, checkpoints=checkpoints, pool=pool):
+                    events.put(('event', event))
+            result = ('done', None)
+        except StepCanceled as e:
+            result = ('canceled', None)
+        except Exception as e:
+            result = ('error', traceback.format_exc())
+        # the step records (layerstools, processing, scheduler...) go to the report of the parent
+        events.put(('records', instrumentation.takeRecords()))
+        events.put(result)
+        idle.set()
+    if pool is not None:
+        # work units of a canceled step may still be queued
+        if cancelEvent.is_set():
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+    if app is not None:
+        app.exitQgis()
+
+# context the step host is started with: it is spawned and needs a python interpreter.
+# In QGIS on Linux, the executable of the current process is QGIS itself
+# (Windows and Mac interpreters are set when the plugin is loaded)
+def spawnContext():
+    context = multiprocessing.get_context('spawn')
+    if not os.path.basename(os.fsdecode(multiprocessing.spawn.get_executable())).lower().startswith('python'):
+        context.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return context
+
+# long-lived process running the steps.
+# GRASS environment, hrudelinCore modules and heavy imports are loaded once per session
+# instead of once per step. Steps accepting a pool argument share a pool of nbProcess
+# workers started at the first of them.
+# environment: variables set in the host and its workers (raster profile...)
+# the host is spawned, never forked: a fork of the QGIS GUI can not start its own QGIS.
+# qgisPrefixPath: QGIS installation used to initialize QGIS and processing in the host
+class StepHost:
+    def __init__(self, nbProcess, grassArgs=(), environment={}, qgisPrefixPath=None):
+        self.nbProcess = nbProcess
+        self.environment = dict(environment)
+        context = spawnContext()
+        self.requests = context.Queue()
+        self.events = context.Queue()
+        self.cancelEvent = context.Event()
+        self.lock = threading.Lock()
+        self.process = context.Process(
+            target=stepHostMain,
+            args=(self.requests, self.events, self.cancelEvent, nbProcess, grassArgs, self.environment, qgisPrefixPath),
+            name='hrudelin step host'
+        )
+        self.process.start()
+
+    def isAlive(self):
+        return self.process.is_alive()
+
+    # run a step in the host and yield its events, its instrumentation records are merged in this process
+    # setting cancelEvent stops the step and all its worker processes within a few seconds,
+    # StepCanceled is then raised and the host is gone.
+    # finished work units of a previous run are reused if checkpointSignature is the same
+    def run(self, step, project, cancelEvent, checkpointSignature=None):
+        with self.lock:
+            self.requests.put((step, project, checkpointSignature))
+            finished = False
+            try:
+                while True:
+                    if cancelEvent.is_set():
+                        self.cancelEvent.set()
+                    try:
+                        kind, value = self.events.get(timeout=0.5)
+                    except queue.Empty:
+                        if self.process.is_alive():
+                            continue
+                        if cancelEvent.is_set():
+                            raise StepCanceled('step %s canceled' % step)
+                        raise Exception('step %s process stopped unexpectedly (exit code %s)' % (step, self.process.exitcode))
+                    if kind == 'event':
+                        yield value
+                    elif kind == 'records':
+                        instrumentation.mergeRecords(value)
+                    elif kind == 'done':
+                        finished = True
+                        return
+                    elif kind == 'canceled':
+                        raise StepCanceled('step %s canceled' % step)
+                    else:
+                        finished = True
+                        raise Exception('step %s failed:\n%s' % (step, value))
+            finally:
+                # the step is still running or was canceled, the host can not be reused
+                if not finished:
+                    self.cancelEvent.set()
+                    self.shutdown()
+
+    def shutdown(self):
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(CANCEL_GRACE_DELAY + 3)
+        if self.process.is_alive():
+            self.cancelEvent.set()
+            self.process.join(CANCEL_GRACE_DELAY + 3)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
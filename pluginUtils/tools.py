@@ -2,6 +2,8 @@ import platform
 import os, sys
 from pathlib import Path
 import subprocess
+import json
+from hrudelin.pluginUtils.instrumentation import formatBytes
 
 def isWindows():
     plat = platform.system()
@@ -28,16 +30,75 @@ def which(program):
 
     return None
 
-def split_list(alist, wanted_parts=1):
-    length = len(alist)
-    return [ alist[i*length // wanted_parts: (i+1)*length // wanted_parts]
-             for i in range(wanted_parts) ]
+# without costs, parts have the same number of items.
+# with costs (list in the same order as alist, or function(item)), items are given
+# largest first to the least loaded part so parts have about the same total cost.
+# prefer scheduler.scheduleUnits for parallel dispatch, it balances the load while running
+def split_list(alist, wanted_parts=1, costs=None):
+    if costs is None:
+        length = len(alist)
+        return [ alist[i*length // wanted_parts: (i+1)*length // wanted_parts]
+                 for i in range(wanted_parts) ]
+    if callable(costs):
+        costs = [costs(item) for item in alist]
+    parts = [[] for i in range(wanted_parts)]
+    loads = [0] * wanted_parts
+    for i in sorted(range(len(alist)), key=lambda i: costs[i], reverse=True):
+        lightest = loads.index(min(loads))
+        parts[lightest].append(alist[i])
+        loads[lightest] += costs[i]
+    return parts
 
-def prepareGrassEnv():
+# memory (bytes) which can be used without making the system swap
+def availableMemory():
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError as e:
+        pass
+    if os.path.exists('/proc/meminfo'):
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, AttributeError, OSError) as e:
+        return None
+
+# a worker holds several full-raster arrays (DEM, directions, accumulation, sub-basins...)
+# of at least 4 bytes per cell, on top of its interpreter with GDAL and numpy
+ARRAYS_PER_WORKER = 6
+WORKER_BASE_MEMORY = 200 * 1024 * 1024
+# part of the available memory given to the workers
+MEMORY_USAGE_RATIO = 0.8
+
+# number of processes fitting in memory for a DEM, returns it with an explanation
+def autoProcessCount(cells, bytesPerCell, maxProcess, memory=None):
+    if memory is None:
+        memory = availableMemory()
+    workerMemory = cells * max(bytesPerCell, 4) * ARRAYS_PER_WORKER + WORKER_BASE_MEMORY
+    if memory is None:
+        return maxProcess, 'available memory unknown, using %s processes' % maxProcess
+    fitting = int(memory * MEMORY_USAGE_RATIO // workerMemory)
+    nbProcess = max(1, min(maxProcess, fitting))
+    explanation = '%s process%s: about %s per process, %s available' % (
+        nbProcess, 'es' if nbProcess > 1 else '', formatBytes(workerMemory), formatBytes(memory)
+    )
+    if fitting < 1:
+        explanation += ', even one process might swap'
+    elif fitting < maxProcess:
+        explanation += ', limited by memory (%s CPUs)' % maxProcess
+    return nbProcess, explanation
+
+GRASS_VERSIONS = ['74', '75', '76', '77', '78', '79']
+grassEnvReady = False
+
+# find grass depending on the system
+def findGrassBasePath():
     grassBasePath = None
-    # find grass depending on the system
     if isWindows():
-        for grassVersion in ['74', '75', '76', '77', '78', '79']:
+        for grassVersion in GRASS_VERSIONS:
             try:
                 grassBasePath = subprocess.check_output(['grass%s.bat' % grassVersion, '--config', 'path'], shell=True).decode('utf-8').rstrip(os.linesep)
                 break
@@ -46,21 +107,75 @@ def prepareGrassEnv():
 
     elif isMac():
         qgisContents = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(sys.exec_prefix))))
-        for grassVersion in ['74', '75', '76', '77', '78', '79']:
+        for grassVersion in GRASS_VERSIONS:
             candidatePath = os.path.join(qgisContents, 'Resources', 'grass7')
             if os.path.isfile(os.path.join(candidatePath, 'bin', 'grass%s' % grassVersion)):
                 grassBasePath = candidatePath
                 break
         pass
     else:
-        grassBasePath = subprocess.check_output(['grass', '--config', 'path']).decode('utf-8').rstrip(os.linesep)
+        try:
+            grassBasePath = subprocess.check_output(['grass', '--config', 'path']).decode('utf-8').rstrip(os.linesep)
+        except Exception as e:
+            grassBasePath = None
         if grassBasePath == None:
-            for grassVersion in ['74', '75', '76', '77', '78', '79']:
+            for grassVersion in GRASS_VERSIONS:
                 findRes = list(Path('/usr/lib/grass%s' % grassVersion).rglob('*r.thin*'))
                 if len(findRes) > 0:
                     thinPath = str(findRes[0])
                     grassBasePath = os.path.dirname(os.path.dirname(thinPath))
                     break
+    return grassBasePath
+
+def getGrassVersion(grassBasePath):
+    try:
+        with open(os.path.join(grassBasePath, 'etc', 'VERSIONNUMBER')) as f:
+            return f.read().split()[0]
+    except Exception as e:
+        return None
+
+# the cache is only valid for the same QGIS/python install and the same GRASS version
+def grassCacheKey(qgisVersion):
+    return '%s|%s|%s' % (qgisVersion, platform.platform(), sys.exec_prefix)
+
+def readGrassCache(cachePath, cacheKey):
+    try:
+        with open(cachePath) as f:
+            cache = json.load(f)
+    except Exception as e:
+        return None
+    grassBasePath = cache.get('gisbase')
+    if cache.get('key') != cacheKey or not grassBasePath or not os.path.isdir(os.path.join(grassBasePath, 'bin')):
+        return None
+    if getGrassVersion(grassBasePath) != cache.get('grassVersion'):
+        return None
+    return grassBasePath
+
+def writeGrassCache(cachePath, cacheKey, grassBasePath):
+    try:
+        with open(cachePath, 'w') as f:
+            json.dump({
+                'key': cacheKey,
+                'gisbase': grassBasePath,
+                'grassVersion': getGrassVersion(grassBasePath),
+            }, f)
+    except Exception as e:
+        print('impossible to write GRASS cache file %s: %s' % (cachePath, e))
+
+# called lazily when a step needs GRASS, it does nothing if the environment is already set
+def prepareGrassEnv(cachePath=None, qgisVersion=''):
+    global grassEnvReady
+    if grassEnvReady:
+        return
+
+    grassBasePath = None
+    cacheKey = grassCacheKey(qgisVersion)
+    if cachePath:
+        grassBasePath = readGrassCache(cachePath, cacheKey)
+    if grassBasePath == None:
+        grassBasePath = findGrassBasePath()
+        if grassBasePath != None and cachePath:
+            writeGrassCache(cachePath, cacheKey, grassBasePath)
 
     if grassBasePath == None:
         print('GRASS not found on your system')
@@ -100,4 +215,6 @@ def prepareGrassEnv():
         os.environ['PATH'] = '%s%s%s' % (existingPath, os.pathsep, grassBinPath)
         existingPath = os.environ['PATH']
     if grassScriptPath not in existingPath.split(os.pathsep):
-        os.environ['PATH'] = '%s%s%s' % (existingPath, os.pathsep, grassScriptPath)
\ No newline at end of file
+        os.environ['PATH'] = '%s%s%s' % (existingPath, os.pathsep, grassScriptPath)
+
+    grassEnvReady = True
@@ -0,0 +1,10 @@
+import os, sys, types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# the plugin modules import each other as the hrudelin package whatever the name of the
+# plugin directory. The package __init__ needs QGIS, it is not run
+if 'hrudelin' not in sys.modules:
+    package = types.ModuleType('hrudelin')
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules['hrudelin'] = package
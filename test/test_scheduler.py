@@ -0,0 +1,55 @@
+import multiprocessing
+
+from hrudelin.pluginUtils.scheduler import scheduleUnits, sortByCost
+from hrudelin.pluginUtils.tools import split_list
+
+WORKERS = 4
+# a few big sub-basins among many small ones, the big ones first as basin ids often are
+SKEWED_COSTS = [100, 90, 80, 70] + [1] * 36
+
+# makespan of units dispatched in order to the first free worker
+def dynamicMakespan(costs, workers):
+    loads = [0] * workers
+    for cost in costs:
+        loads[loads.index(min(loads))] += cost
+    return max(loads)
+
+def staticMakespan(parts):
+    return max(sum(part) for part in parts)
+
+def test_schedule_balances_skewed_costs_better_than_split_list():
+    units = list(range(len(SKEWED_COSTS)))
+    order = [unit for unit, result in scheduleUnits(abs, units, SKEWED_COSTS)]
+    scheduled = dynamicMakespan([SKEWED_COSTS[unit] for unit in order], WORKERS)
+    static = staticMakespan(split_list(SKEWED_COSTS, WORKERS))
+    assert scheduled == 100
+    assert static == 346
+    # no schedule ends before the largest unit
+    assert scheduled == max(SKEWED_COSTS)
+
+def test_split_list_with_costs_balances_parts():
+    parts = split_list(SKEWED_COSTS, WORKERS, SKEWED_COSTS)
+    assert sorted(sum(parts, [])) == sorted(SKEWED_COSTS)
+    assert staticMakespan(parts) == 100
+
+def test_sort_by_cost_accepts_mapping_function_and_list():
+    units = ['a', 'b', 'c']
+    expected = ['b', 'c', 'a']
+    assert sortByCost(units, {'a': 1, 'b': 3, 'c': 2}) == expected
+    assert sortByCost(units, {'b': 3, 'c': 2}) == expected
+    assert sortByCost(units, lambda unit: {'a': 1, 'b': 3, 'c': 2}[unit]) == expected
+    assert sortByCost(units, [1, 3, 2]) == expected
+
+def test_sort_by_cost_rejects_wrong_length():
+    try:
+        sortByCost(['a', 'b'], [1])
+        assert False, 'TypeError expected'
+    except TypeError:
+        pass
+
+def test_schedule_units_in_pool():
+    units = list(range(10))
+    # forked workers inherit the hrudelin package set up by conftest
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+        results = dict(scheduleUnits(abs, [-u for u in units], pool=pool))
+    assert sorted(results.values()) == units
@@ -0,0 +1,116 @@
+import os, threading
+
+from hrudelin.pluginUtils.stepcache import StepCache, StepCheckpoints, MANIFEST_NAME, CHECKPOINTS_NAME
+from hrudelin.pluginUtils.steps import runStep, cleanStep, StepCanceled
+
+SIGNATURE = 'config-signature'
+UNITS = [1, 2, 3, 4]
+
+def makeProject(tmp_path):
+    project = {
+        'projectFilePath': str(tmp_path / 'project.cfg'),
+        'filesOutPath': str(tmp_path / 'files'),
+        'resultsOutPath': str(tmp_path / 'results'),
+        'tmpPath': str(tmp_path / 'tmp'),
+    }
+    for key in ['filesOutPath', 'resultsOutPath', 'tmpPath']:
+        os.mkdir(project[key])
+    return project
+
+# a step computing one raster per sub-basin, the units it really computed are recorded in computed
+def fakeStep(project, computed, cancelAfter=None):
+    def main(projectFilePath, nbProcess, fromPlugin, cancelEvent=None, checkpoints=None):
+        for unit in UNITS:
+            if cancelEvent is not None and cancelEvent.is_set():
+                return
+            path = os.path.join(project['filesOutPath'], 'step2_subbasin_%s.tif' % unit)
+            if checkpoints.isDone(unit):
+                continue
+            with open(path, 'w') as f:
+                f.write('unit %s' % unit)
+            computed.append(unit)
+            checkpoints.markDone(unit, [path])
+            if unit == cancelAfter:
+                cancelEvent.set()
+            yield 100 * unit // len(UNITS)
+    return main
+
+def run(project, stepMain, cancelEvent):
+    checkpoints = StepCheckpoints(project['filesOutPath'], 2, SIGNATURE)
+    for event in runStep(2, project, 1, stepMain, cancelEvent=cancelEvent, checkpoints=checkpoints):
+        pass
+
+def test_resumed_step_skips_finished_units(tmp_path):
+    project = makeProject(tmp_path)
+    computed = []
+    cancelEvent = threading.Event()
+    try:
+        run(project, fakeStep(project, computed, cancelAfter=2), cancelEvent)
+        assert False, 'the step should have been canceled'
+    except StepCanceled:
+        pass
+    assert computed == [1, 2]
+
+    # the plugin cleans a canceled step keeping the checkpointed outputs
+    checkpoints = StepCheckpoints(project['filesOutPath'], 2, SIGNATURE)
+    cleanStep(2, project, checkpoints.keptFiles())
+    assert os.path.isfile(checkpoints.path)
+    assert os.path.isfile(os.path.join(project['filesOutPath'], 'step2_subbasin_1.tif'))
+
+    computed.clear()
+    run(project, fakeStep(project, computed), threading.Event())
+    assert computed == [3, 4]
+    # the checkpoints of a finished step are removed
+    assert not os.path.exists(checkpoints.path)
+
+def test_changed_signature_recomputes_everything(tmp_path):
+    project = makeProject(tmp_path)
+    checkpoints = StepCheckpoints(project['filesOutPath'], 2, SIGNATURE)
+    path = os.path.join(project['filesOutPath'], 'step2_subbasin_1.tif')
+    with open(path, 'w') as f:
+        f.write('unit 1')
+    checkpoints.markDone(1, [path])
+    assert StepCheckpoints(project['filesOutPath'], 2, SIGNATURE).isDone(1)
+    assert not StepCheckpoints(project['filesOutPath'], 2, 'other').isDone(1)
+
+def test_modified_output_is_not_done(tmp_path):
+    project = makeProject(tmp_path)
+    checkpoints = StepCheckpoints(project['filesOutPath'], 2, SIGNATURE)
+    path = os.path.join(project['filesOutPath'], 'step2_subbasin_1.tif')
+    with open(path, 'w') as f:
+        f.write('unit 1')
+    checkpoints.markDone(1, [path])
+    with open(path, 'w') as f:
+        f.write('modified unit 1')
+    assert not checkpoints.isDone(1)
+    assert checkpoints.keptFiles() == set()
+
+def test_step1_cleaning_keeps_cache_files(tmp_path):
+    project = makeProject(tmp_path)
+    kept = [os.path.join(project['filesOutPath'], name) for name in [MANIFEST_NAME, CHECKPOINTS_NAME % 1]]
+    removed = os.path.join(project['filesOutPath'], 'step1_dem.tif')
+    for path in kept + [removed]:
+        with open(path, 'w') as f:
+            f.write('{}')
+    cleanStep(1, project)
+    assert all(os.path.isfile(path) for path in kept)
+    assert not os.path.exists(removed)
+
+def test_any_config_change_invalidates_cached_steps(tmp_path):
+    project = makeProject(tmp_path)
+    def writeConfig(minSize):
+        with open(project['projectFilePath'], 'w') as f:
+            f.write('[dir_in]\ndir = .\n[files_in]\n[topology]\nmin_size = %s\n' % minSize)
+    writeConfig(10)
+    for step in [1, 2]:
+        with open(os.path.join(project['filesOutPath'], 'step%s_out.tif' % step), 'w') as f:
+            f.write('raster')
+    cache = StepCache(project['projectFilePath'], project['filesOutPath'], project['resultsOutPath'])
+    cache.store(1)
+    cache.store(2)
+    assert cache.isValid(2)
+
+    writeConfig(20)
+    cache = StepCache(project['projectFilePath'], project['filesOutPath'], project['resultsOutPath'])
+    assert not cache.isValid(1)
+    assert not cache.isValid(2)
@@ -0,0 +1,43 @@
+import os, time
+
+from hrudelin.pluginUtils import steps
+from hrudelin.pluginUtils.steps import runStep
+
+def makeProject(tmp_path):
+    project = {
+        'projectFilePath': str(tmp_path / 'project.cfg'),
+        'filesOutPath': str(tmp_path / 'files'),
+        'resultsOutPath': str(tmp_path / 'results'),
+        'tmpPath': str(tmp_path / 'tmp'),
+    }
+    for key in ['filesOutPath', 'resultsOutPath', 'tmpPath']:
+        os.mkdir(project[key])
+    return project
+
+def writeOutput(path):
+    with open(path, 'w') as f:
+        f.write('raster')
+
+def test_outputs_of_a_step_without_progress_are_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(steps, 'OUTPUT_SETTLE_DELAY', 0)
+    project = makeProject(tmp_path)
+    dem = os.path.join(project['filesOutPath'], 'step1_dem.tif')
+    def main(projectFilePath):
+        writeOutput(dem)
+        time.sleep(2.5)
+        writeOutput(os.path.join(project['filesOutPath'], 'step1_slope.tif'))
+    layers = [event['layer'] for event in runStep(1, project, 1, main) if 'layer' in event]
+    # the last output is published with the other outputs when the step is done
+    assert layers == [dem]
+
+def test_outputs_of_a_step_are_reported_between_progress_events(tmp_path, monkeypatch):
+    monkeypatch.setattr(steps, 'OUTPUT_SETTLE_DELAY', 0)
+    project = makeProject(tmp_path)
+    paths = [os.path.join(project['filesOutPath'], 'step2_subbasin_%s.tif' % unit) for unit in [1, 2]]
+    def main(projectFilePath, nbProcess, fromPlugin):
+        for path in paths:
+            writeOutput(path)
+            yield 0
+            yield 50
+    layers = [event['layer'] for event in runStep(2, project, 1, main) if 'layer' in event]
+    assert layers == paths
@@ -10,6 +10,7 @@ mkdir /tmp/hrudelin
 cp -r * /tmp/hrudelin/
 cd /tmp
 rm -f hrudelin/*.sh hrudelin/version.txt
+rm -rf hrudelin/benchmarks
 find hrudelin -name "*.pyc" -delete
 find hrudelin -name "__pycache__" -delete
 sed -i 's/^version=.*/version='$version'/' hrudelin/metadata.txt